@@ -0,0 +1,242 @@
+# Importing the necessary Python libraries
+import os
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from pydub import AudioSegment
+from pydub.silence import detect_silence
+
+
+
+## AUDIO SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the target length of each segment sent to Whisper, in milliseconds
+SEGMENT_MS = 120 * 1000
+
+# Setting how far either side of a target cut point to look for a silence to cut at, in milliseconds
+SILENCE_SEARCH_MS = 15 * 1000
+
+# Setting how long (and how much quieter than the recording on average) a pause must be to count as a silence
+MIN_SILENCE_MS = 500
+SILENCE_THRESHOLD_DB = 16
+
+# Setting how much audio each segment shares with its neighbours, so words at the cut are not lost
+OVERLAP_MS = 2 * 1000
+
+# Setting whether to downmix, resample and re-encode recordings as low bitrate segments before upload, which is plenty for speech
+# and far smaller (when turned off, short recordings are uploaded untouched and longer ones are split into lossless segments)
+COMPRESS_AUDIO = True
+COMPRESSED_CHANNELS = 1
+COMPRESSED_FRAME_RATE = 16000
+
+# Setting the format (and bitrate) each segment is encoded in before it is uploaded, when compressing and when not
+SEGMENT_FORMAT = 'mp3'
+SEGMENT_BITRATE = '32k'
+LOSSLESS_SEGMENT_FORMAT = 'flac'
+
+# Setting the file formats Whisper accepts as they are, and the largest file it accepts
+WHISPER_FORMATS = ('flac', 'm4a', 'mp3', 'mp4', 'mpeg', 'mpga', 'oga', 'ogg', 'wav', 'webm')
+WHISPER_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+
+# Setting how many prepared recordings are kept in memory, keyed by the hash of the original upload
+PREPARED_AUDIO_CACHE_SIZE = 16
+
+# Keeping track of the prepared recordings
+prepared_audio_cache = OrderedDict()
+prepared_audio_lock = threading.Lock()
+
+# Setting the most words to compare when looking for text repeated across the overlap between two segments
+MAX_OVERLAP_WORDS = 20
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def find_cut_points(audio):
+    '''
+    Finds where to cut a recording into segments, preferring the middle of a silence near each target cut point
+
+    Inputs:
+        - audio (AudioSegment): The full recording
+
+    Returns:
+        - cut_points (list): The cut points in milliseconds, including the start and end of the recording
+    '''
+
+    cut_points = [0]
+
+    while len(audio) - cut_points[-1] > SEGMENT_MS:
+        target_cut = cut_points[-1] + SEGMENT_MS
+
+        # Looking for silences around the target cut point
+        search_start = max(cut_points[-1] + SEGMENT_MS // 2, target_cut - SILENCE_SEARCH_MS)
+        search_end = min(len(audio), target_cut + SILENCE_SEARCH_MS)
+        silences = detect_silence(
+            audio[search_start:search_end],
+            min_silence_len = MIN_SILENCE_MS,
+            silence_thresh = audio.dBFS - SILENCE_THRESHOLD_DB
+        )
+
+        # Cutting in the middle of the silence closest to the target, or right at the target if there is no silence
+        silence_midpoints = [search_start + (silence_start + silence_end) // 2 for silence_start, silence_end in silences]
+        cut_points.append(min(silence_midpoints, key = lambda midpoint: abs(midpoint - target_cut), default = target_cut))
+
+    cut_points.append(len(audio))
+
+    return cut_points
+
+
+
+def load_audio(audio_file):
+    '''
+    Loads a recording into memory, whatever its format, so nothing has to be renamed or kept open on disk
+
+    Inputs:
+        - audio_file (str or file): The path to the recording, or an in-memory file holding it
+
+    Returns:
+        - audio (AudioSegment): The decoded recording
+    '''
+
+    # Letting ffmpeg work out the format from the contents, since Gradio's temp files do not carry an extension
+    return AudioSegment.from_file(audio_file)
+
+
+
+def split_audio(audio, segment_format = SEGMENT_FORMAT, segment_bitrate = SEGMENT_BITRATE):
+    '''
+    Splits a recording into overlapping segments cut at silences, each encoded as an in-memory file ready to upload
+
+    Inputs:
+        - audio (AudioSegment): The recording, as loaded by load_audio
+        - segment_format (str): The format to encode each segment in (default = SEGMENT_FORMAT)
+        - segment_bitrate (str): The bitrate to encode each segment at, or None for formats without one (default = SEGMENT_BITRATE)
+
+    Returns:
+        - audio_segments (list): In-memory audio files, in order, each with a name carrying the right file extension
+    '''
+
+    cut_points = find_cut_points(audio)
+
+    audio_segments = []
+    for segment_index, (segment_start, segment_end) in enumerate(zip(cut_points, cut_points[1:])):
+
+        # Exporting the segment, padded with a little overlap on either side, into memory
+        audio_segment = BytesIO()
+        audio[max(0, segment_start - OVERLAP_MS):segment_end + OVERLAP_MS].export(audio_segment, format = segment_format, bitrate = segment_bitrate)
+        audio_segment.name = f'segment-{segment_index}.{segment_format}'
+        audio_segment.seek(0)
+        audio_segments.append(audio_segment)
+
+    return audio_segments
+
+
+
+def compress_audio(audio):
+    '''
+    Downmixes a recording to mono and resamples it to 16 kHz, which is all Whisper needs for speech
+
+    Inputs:
+        - audio (AudioSegment): The recording
+
+    Returns:
+        - audio (AudioSegment): The downmixed and resampled recording
+    '''
+
+    return audio.set_channels(COMPRESSED_CHANNELS).set_frame_rate(COMPRESSED_FRAME_RATE)
+
+
+
+def prepare_audio_segments(audio_path):
+    '''
+    Loads, optionally compresses and splits a recording into segments ready to upload, reusing the work for repeat uploads
+
+    Inputs:
+        - audio_path (str): The path to the recording
+
+    Returns:
+        - audio_segments (list): In-memory audio files, in order, each with a name carrying the right file extension
+    '''
+
+    with open(audio_path, 'rb') as f:
+        audio_bytes = f.read()
+
+    # Preparing the segments only if this exact recording has not been prepared before
+    cache_key = hashlib.sha256(audio_bytes).hexdigest()
+    with prepared_audio_lock:
+        prepared_segments = prepared_audio_cache.get(cache_key)
+        if prepared_segments is not None:
+            prepared_audio_cache.move_to_end(cache_key)
+
+    if prepared_segments is None:
+        audio = load_audio(BytesIO(audio_bytes))
+        upload_format = os.path.splitext(audio_path)[1][1:].lower()
+
+        if COMPRESS_AUDIO:
+            audio_segments = split_audio(compress_audio(audio))
+        elif len(audio) <= SEGMENT_MS and upload_format in WHISPER_FORMATS and len(audio_bytes) <= WHISPER_MAX_UPLOAD_BYTES:
+            # Uploading a short recording exactly as it came in, since Whisper can take it as it is
+            audio_segments = [BytesIO(audio_bytes)]
+            audio_segments[0].name = f'segment-0.{upload_format}'
+        else:
+            audio_segments = split_audio(audio, LOSSLESS_SEGMENT_FORMAT, None)
+
+        del audio_bytes
+        prepared_segments = [(audio_segment.name, audio_segment.getvalue()) for audio_segment in audio_segments]
+
+        with prepared_audio_lock:
+            prepared_audio_cache[cache_key] = prepared_segments
+            while len(prepared_audio_cache) > PREPARED_AUDIO_CACHE_SIZE:
+                prepared_audio_cache.popitem(last = False)
+
+    # Handing out fresh in-memory files each time, since the caller closes them once they have been uploaded
+    audio_segments = []
+    for segment_name, segment_bytes in prepared_segments:
+        audio_segment = BytesIO(segment_bytes)
+        audio_segment.name = segment_name
+        audio_segments.append(audio_segment)
+
+    return audio_segments
+
+
+
+def normalize_word(word):
+    '''
+    Normalizes a word for comparison across segments, ignoring case and punctuation
+
+    Inputs:
+        - word (str): A word from a transcript
+
+    Returns:
+        - normalized_word (str): The word in lowercase with punctuation stripped
+    '''
+
+    return ''.join(character for character in word.lower() if character.isalnum())
+
+
+
+def merge_transcripts(previous_text, next_text):
+    '''
+    Stitches the transcript of a segment onto the transcript so far, dropping words repeated across their overlap
+
+    Inputs:
+        - previous_text (str): The transcript so far
+        - next_text (str): The transcript of the next segment
+
+    Returns:
+        - merged_text (str): The combined transcript
+    '''
+
+    previous_words, next_words = previous_text.split(), next_text.split()
+    previous_tail = [normalize_word(word) for word in previous_words[-MAX_OVERLAP_WORDS:]]
+    next_head = [normalize_word(word) for word in next_words[:MAX_OVERLAP_WORDS]]
+
+    # Finding the longest run of words that ends the transcript so far and starts the next segment
+    overlap_length = 0
+    for candidate_length in range(min(len(previous_tail), len(next_head)), 0, -1):
+        if previous_tail[-candidate_length:] == next_head[:candidate_length]:
+            overlap_length = candidate_length
+            break
+
+    return ' '.join(previous_words + next_words[overlap_length:])
@@ -0,0 +1,170 @@
+# Importing the necessary Python libraries
+import os
+import csv
+import json
+import asyncio
+import argparse
+from image_io import save_b64_image
+from request_scheduler import BATCH_PRIORITY, async_scheduled_api_call
+
+
+
+## OPENAI CONNECTION
+## ---------------------------------------------------------------------------------------------------------------------
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai, get_async_session
+
+# Setting the name of the file in the output directory that records which prompts are done
+CHECKPOINT_FILE_NAME = 'checkpoint.jsonl'
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def read_prompts(prompt_file):
+    '''
+    Reads prompts one at a time from a JSONL or CSV file, so even very large prompt files are never held in memory
+
+    Inputs:
+        - prompt_file (str): The path to a .jsonl file of {"prompt": ..., "id": ...} objects, or a .csv file with prompt and id columns
+
+    Yields:
+        - prompt_id (str): The ID of the prompt (its line number if the file does not give one)
+        - prompt (str): The text of the prompt
+    '''
+
+    with open(prompt_file, newline = '') as f:
+        prompt_rows = csv.DictReader(f) if prompt_file.endswith('.csv') else (json.loads(line) for line in f if line.strip())
+
+        for row_number, prompt_row in enumerate(prompt_rows, start = 1):
+            yield str(prompt_row.get('id') or row_number), prompt_row['prompt']
+
+
+
+def load_checkpoint(output_dir):
+    '''
+    Loads the IDs of the prompts that were already generated by an earlier run
+
+    Inputs:
+        - output_dir (str): The directory the images (and the checkpoint) are written to
+
+    Returns:
+        - completed_ids (set): The IDs of the prompts that have already been generated
+    '''
+
+    completed_ids = set()
+    checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILE_NAME)
+
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            for line in f:
+
+                # Skipping a partially written final line left behind by a crash
+                try:
+                    checkpoint_entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                if checkpoint_entry['status'] == 'done':
+                    completed_ids.add(checkpoint_entry['id'])
+
+    return completed_ids
+
+
+
+async def generate_image_to_file(prompt, output_path, size):
+    '''
+    Generates an image using the DALL-E API and writes it straight to disk
+
+    Inputs:
+        - prompt (str): A body of text describing what the image should show
+        - output_path (str): Where to write the PNG
+        - size (str): The size of the image to generate
+
+    Returns:
+        - N/A
+    '''
+
+    # Checking that the prompt does not exceed 1000 characters
+    if len(prompt) > 1000:
+        raise ValueError('Input prompt cannot exceed 1000 characters.')
+
+    # Skipping the response cache, since the images on disk (and the checkpoint) already stop prompts being redone
+    openai_response = await async_scheduled_api_call(
+        openai.Image.acreate,
+        priority = BATCH_PRIORITY,
+        prompt = prompt,
+        n = 1,
+        size = size,
+        response_format = 'b64_json'
+    )
+
+    # Decoding and writing the image off the event loop, so the other workers' requests keep flowing meanwhile
+    await asyncio.to_thread(save_b64_image, openai_response['data'][0]['b64_json'], output_path)
+
+
+
+async def generate_batch(prompt_file, output_dir, num_workers, size):
+    '''
+    Generates an image for every prompt in a prompt file with a bounded pool of workers, picking up where a previous run left off
+
+    Inputs:
+        - prompt_file (str): The path to the JSONL or CSV file of prompts
+        - output_dir (str): The directory to write the images (and the checkpoint) to
+        - num_workers (int): The number of images to generate at the same time
+        - size (str): The size of the images to generate
+
+    Returns:
+        - batch_counts (dict): The number of prompts that were generated, skipped and failed
+    '''
+
+    os.makedirs(output_dir, exist_ok = True)
+    completed_ids = load_checkpoint(output_dir)
+    prompts = read_prompts(prompt_file)
+    batch_counts = {'generated': 0, 'skipped': 0, 'failed': 0}
+
+    with open(os.path.join(output_dir, CHECKPOINT_FILE_NAME), 'a') as checkpoint_file:
+
+        async def worker():
+            # Pulling prompts off the shared iterator until it runs dry, so only num_workers prompts are in flight at once
+            for prompt_id, prompt in prompts:
+                if prompt_id in completed_ids:
+                    batch_counts['skipped'] += 1
+                    continue
+
+                try:
+                    await generate_image_to_file(prompt, os.path.join(output_dir, f'{prompt_id}.png'), size)
+                    checkpoint_entry = {'id': prompt_id, 'status': 'done'}
+                    batch_counts['generated'] += 1
+                except Exception as error:
+                    checkpoint_entry = {'id': prompt_id, 'status': 'failed', 'error': str(error)}
+                    batch_counts['failed'] += 1
+
+                # Recording the result straight away so a crash never loses more than the prompts in flight
+                checkpoint_file.write(json.dumps(checkpoint_entry) + '\n')
+                checkpoint_file.flush()
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(num_workers)])
+        finally:
+            await get_async_session().close()
+
+    return batch_counts
+
+
+
+## SCRIPT INVOCATION
+## ---------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # Setting up the command line arguments
+    parser = argparse.ArgumentParser(description = 'Generates a DALL-E image for every prompt in a JSONL or CSV file.')
+    parser.add_argument('prompt_file', help = 'A .jsonl file of {"prompt": ..., "id": ...} objects, or a .csv file with prompt and id columns')
+    parser.add_argument('output_dir', help = 'The directory to write the images to (re-running with the same directory resumes the batch)')
+    parser.add_argument('--workers', type = int, default = 8, help = 'The number of images to generate at the same time (default = 8)')
+    parser.add_argument('--size', default = '1024x1024', choices = ['256x256', '512x512', '1024x1024'], help = 'The size of the images (default = 1024x1024)')
+    args = parser.parse_args()
+
+    # Running the batch and reporting how it went
+    batch_counts = asyncio.run(generate_batch(args.prompt_file, args.output_dir, args.workers, args.size))
+    print(f"Generated {batch_counts['generated']} images, skipped {batch_counts['skipped']} already done, {batch_counts['failed']} failed.")
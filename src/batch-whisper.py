@@ -0,0 +1,194 @@
+# Importing the necessary Python libraries
+import os
+import json
+import asyncio
+import hashlib
+import argparse
+from audio_io import prepare_audio_segments, merge_transcripts
+from request_scheduler import BATCH_PRIORITY, async_scheduled_api_call
+
+
+
+## OPENAI CONNECTION
+## ---------------------------------------------------------------------------------------------------------------------
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai, get_async_session
+
+# Setting the audio file extensions picked up when transcribing a whole directory
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.mp4', '.mpeg', '.mpga', '.wav', '.webm', '.ogg', '.flac')
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def list_audio_files(audio_source):
+    '''
+    Lists the audio files to transcribe from a directory or from a manifest file
+
+    Inputs:
+        - audio_source (str): A directory of audio files, or a manifest file listing one audio file path per line
+
+    Returns:
+        - audio_paths (list): The paths of the audio files to transcribe
+    '''
+
+    if os.path.isdir(audio_source):
+        return sorted(
+            os.path.join(audio_source, file_name) for file_name in os.listdir(audio_source)
+            if file_name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+
+    # Reading paths from the manifest relative to where the manifest lives
+    with open(audio_source) as f:
+        manifest_dir = os.path.dirname(audio_source)
+        return [os.path.join(manifest_dir, line.strip()) for line in f if line.strip()]
+
+
+
+def hash_file(file_path):
+    '''
+    Hashes the contents of a file, so files are recognized as already transcribed even if they are renamed or moved
+
+    Inputs:
+        - file_path (str): The path to the file
+
+    Returns:
+        - file_hash (str): The SHA-256 hex digest of the file
+    '''
+
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for file_chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(file_chunk)
+
+    return file_hash.hexdigest()
+
+
+
+def load_transcribed_hashes(output_file):
+    '''
+    Loads the hashes of the audio files already transcribed into the output file by an earlier run
+
+    Inputs:
+        - output_file (str): The path to the JSONL file of transcripts
+
+    Returns:
+        - transcribed_hashes (set): The content hashes of the audio files that have already been transcribed
+    '''
+
+    transcribed_hashes = set()
+
+    if os.path.exists(output_file):
+        with open(output_file) as f:
+            for line in f:
+
+                # Skipping a partially written final line left behind by a crash
+                try:
+                    transcript_entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                if 'text' in transcript_entry:
+                    transcribed_hashes.add(transcript_entry['sha256'])
+
+    return transcribed_hashes
+
+
+
+async def transcribe_file(audio_path):
+    '''
+    Transcribes an audio file using OpenAI's Whisper API, transcribing its segments concurrently
+
+    Inputs:
+        - audio_path (str): The path to the audio file
+
+    Returns:
+        - transcript (str): The transcription provided by OpenAI's Whisper API
+    '''
+
+    # Compressing (if COMPRESS_AUDIO is on) and splitting the audio off the event loop, since decoding and encoding it is CPU bound
+    audio_segments = await asyncio.to_thread(prepare_audio_segments, audio_path)
+
+    try:
+        segment_transcripts = await asyncio.gather(*[
+            async_scheduled_api_call(openai.Audio.atranscribe, priority = BATCH_PRIORITY, model = 'whisper-1', file = audio_segment)
+            for audio_segment in audio_segments
+        ])
+    finally:
+        for audio_segment in audio_segments:
+            audio_segment.close()
+
+    # Stitching the segments back together in order, dropping the text repeated across each overlap
+    transcript = ''
+    for segment_transcript in segment_transcripts:
+        transcript = merge_transcripts(transcript, segment_transcript['text'])
+
+    return transcript
+
+
+
+async def transcribe_batch(audio_source, output_file, num_workers):
+    '''
+    Transcribes every audio file in a directory or manifest with a bounded pool of workers, skipping files already transcribed
+
+    Inputs:
+        - audio_source (str): A directory of audio files, or a manifest file listing one audio file path per line
+        - output_file (str): The path to the JSONL file the transcripts are appended to
+        - num_workers (int): The number of audio files to transcribe at the same time
+
+    Returns:
+        - batch_counts (dict): The number of files that were transcribed, skipped and failed
+    '''
+
+    transcribed_hashes = load_transcribed_hashes(output_file)
+    audio_paths = iter(list_audio_files(audio_source))
+    batch_counts = {'transcribed': 0, 'skipped': 0, 'failed': 0}
+
+    with open(output_file, 'a') as transcripts_file:
+
+        async def worker():
+            # Pulling files off the shared iterator until it runs dry, so only num_workers files are in flight at once
+            for audio_path in audio_paths:
+                file_hash = await asyncio.to_thread(hash_file, audio_path)
+                if file_hash in transcribed_hashes:
+                    batch_counts['skipped'] += 1
+                    continue
+
+                # Marking the file as taken so a duplicate copy elsewhere in the batch is not transcribed twice
+                transcribed_hashes.add(file_hash)
+
+                try:
+                    transcript_entry = {'path': audio_path, 'sha256': file_hash, 'text': await transcribe_file(audio_path)}
+                    batch_counts['transcribed'] += 1
+                except Exception as error:
+                    transcribed_hashes.discard(file_hash)
+                    transcript_entry = {'path': audio_path, 'sha256': file_hash, 'error': str(error)}
+                    batch_counts['failed'] += 1
+
+                # Writing each result out as soon as it is ready so a crash never loses finished transcripts
+                transcripts_file.write(json.dumps(transcript_entry) + '\n')
+                transcripts_file.flush()
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(num_workers)])
+        finally:
+            await get_async_session().close()
+
+    return batch_counts
+
+
+
+## SCRIPT INVOCATION
+## ---------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # Setting up the command line arguments
+    parser = argparse.ArgumentParser(description = "Transcribes a directory (or manifest) of audio files with OpenAI's Whisper API.")
+    parser.add_argument('audio_source', help = 'A directory of audio files (e.g. ../data), or a manifest file listing one audio file path per line')
+    parser.add_argument('output_file', help = 'The JSONL file to append transcripts to (files already in it are skipped)')
+    parser.add_argument('--workers', type = int, default = 4, help = 'The number of audio files to transcribe at the same time (default = 4)')
+    args = parser.parse_args()
+
+    # Running the batch and reporting how it went
+    batch_counts = asyncio.run(transcribe_batch(args.audio_source, args.output_file, args.workers))
+    print(f"Transcribed {batch_counts['transcribed']} files, skipped {batch_counts['skipped']} already done, {batch_counts['failed']} failed.")
@@ -1,44 +1,38 @@
-import re
-import time
-import yaml
-import openai
+import asyncio
 import gradio as gr
+from chat_messages import ChatMessage, ChatTurn, serialize_chat_flow
+from conversation_store import ConversationSessions, SQLiteConversationStore
+from sensitive_data import check_sensitive_data, redact_sensitive_data
+from request_scheduler import INTERACTIVE_PRIORITY
+from request_coalescing import async_coalesced_api_call
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## API INSTANTIATION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
 
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Setting whether the chatbot should stream the response back to the user token-by-token
+STREAM_RESPONSES = True
 
+# Setting whether sensitive data is masked out of a prompt and the rest sent on, rather than the whole prompt being rejected
+REDACT_SENSITIVE_DATA = True
 
+# Setting the number of conversations the Gradio queue may work on at the same time (cheap, since the handler is async)
+QUEUE_CONCURRENCY = 64
 
-## HELPER FUNCTIONS
-## ---------------------------------------------------------------------------------------------------------------------
-def initiate_chat_flow():
-    '''
-    Initiates a new chat flow
-
-    Inputs:
-        - N/A
-
-    Returns:
-        - chat_flow (list): A newly initiated chat flow
-    '''
-
-    chat_flow = [
-        {'role': 'system', 'content': 'You are an assistant that speaks like Jar Jar Binks from Star Wars.'}
-    ]
+# Setting the system prompt every conversation opens with
+SYSTEM_PROMPT = 'You are an assistant that speaks like Jar Jar Binks from Star Wars.'
 
-    return chat_flow
+# Keeping every conversation in the on-disk store, with only the recent window of active conversations held in memory
+conversation_sessions = ConversationSessions(SQLiteConversationStore())
 
 
 
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
 def clear_chat_interface():
     '''
     Clears the chat interface when the button is clicked
@@ -47,92 +41,92 @@ def clear_chat_interface():
         - N/A
 
     Returns
-        - N/A
+        - chatbot (Gradio chatbot): An emptied out chatbot interface
+        - conversation_id (str): No conversation, so a new one is started in the store with the user's next prompt
     '''
-    # Referencing the chat flow as a global variable
-    global chat_flow
 
-    # Reinitiating the chat flow
-    chat_flow = initiate_chat_flow()
+    # Letting go of the conversation for this session only (it stays in the store)
+    return None, None
 
 
 
-def check_sensitive_data(user_prompt):
-    '''
-    Checks the user's prompt to see if any sensitive information has been pass in via the prompt
-
-    Inputs:
-        - user_prompt (str): The user's inputted prompt
-
-    Returns:
-        - has_sensitive_data (bool): A boolean value indicating if the prompt contains sensitive data
-    '''
-
-    # Establishing a bit of regex to catch social security numbers
-    ssn_regex = r'\b(?!000)(?!666)(?!9\d{2})\d{3}[-]?(?!00)\d{2}[-]?(?!0000)\d{4}\b'
-
-    # Checking to see if there is a match based on the regex
-    has_sensitive_data = bool(re.search(ssn_regex, user_prompt))
-
-    return has_sensitive_data
-
-
-
-def process_prompt(user_prompt, chatbot):
+@instrumented_handler
+async def process_prompt(user_prompt, chatbot, conversation_id):
     '''
     Processes the user prompt submitted to the chat interface with the appropriate response from OpenAI's API
 
     Inputs:
         - user_prompt (str): The prompt text submitted by the user
         - chatbot (Gradio chatbot): The chatbot interface that is displayed to the user
+        - conversation_id (str): The ID of the stored conversation belonging to the user's browser session, or None if it has not started yet
 
-    Returns:
+    Yields:
         - user_prompt (str): A cleared out prompt ready for the next user input
-        - chatbot (Gradio chatbot): The chatbot interface that is displayed to the user
+        - chatbot (Gradio chatbot): The chatbot interface that is displayed to the user, updated as the response streams in
+        - conversation_id (str): The ID of the stored conversation belonging to the user's browser session
     '''
 
-    # Referencing the chat_flow as a global variable
-    global chat_flow
-
-    # Checking the prompt for any sensitive data
-    has_sensitive_data = check_sensitive_data(user_prompt)
+    # Masking any sensitive data out of the prompt in place, so the rest of it can still be answered in this same request
+    if REDACT_SENSITIVE_DATA:
+        user_prompt, _ = redact_sensitive_data(user_prompt)
 
-    # Prompting the user to submit a new prompt without sensitive data if sensitive data is present
-    if has_sensitive_data:
-
-        # Waiting a beat
-        time.sleep(1)
+    # Otherwise prompting the user to submit a new prompt without sensitive data if sensitive data is present
+    elif check_sensitive_data(user_prompt):
 
         # Adding the appropriate message to the chatbot
         chatbot.append((user_prompt,'Meesa sorry, but it looks like yousa prompt contains sensitive information. For security reasons, meesa cannot let it through. Please be careful not to include any sensitive information in your prompts in the future. If yousa still have a question or concern, please submit a new prompt without the sensitive information, and meesa will do our best to help you. Thank yousa for your understanding!'))
 
         # Clearing the prompt for the next user input
-        user_prompt = ''
-
-        return user_prompt, chatbot
-    
-    # Appending the prompt to the chat flow
-    chat_flow.append({'role': 'user', 'content': user_prompt})
-
-    # Obtaining the response from the API
-    chat_response = openai.ChatCompletion.create(
+        yield '', chatbot, conversation_id
+        return
+
+    # Starting the conversation in the store with the session's first prompt (writing to the store off the event loop)
+    if conversation_id is None:
+        conversation_id = await asyncio.to_thread(conversation_sessions.start_conversation, SYSTEM_PROMPT)
+
+    # Appending the prompt to the stored conversation and getting back its recent window, trimmed to the token budget
+    chat_turn = ChatTurn(ChatMessage('user', user_prompt), ChatMessage('assistant', ''))
+    try:
+        chat_flow = await asyncio.to_thread(conversation_sessions.add_message, conversation_id, chat_turn.prompt)
+    except KeyError:
+        # Starting afresh if the store no longer has the session's conversation (e.g. the store was moved or cleared)
+        conversation_id = await asyncio.to_thread(conversation_sessions.start_conversation, SYSTEM_PROMPT)
+        chat_flow = await asyncio.to_thread(conversation_sessions.add_message, conversation_id, chat_turn.prompt)
+
+    # Obtaining the response from the API over the pooled async session, streamed back in chunks if streaming is enabled
+    # (sharing the call, and fanning its stream out, with anyone sending the exact same conversation at the same time)
+    chat_response = await async_coalesced_api_call(
+        openai.ChatCompletion.acreate,
+        priority = INTERACTIVE_PRIORITY,
         model = 'gpt-3.5-turbo',
-        messages = chat_flow
+        messages = serialize_chat_flow(chat_flow),
+        stream = STREAM_RESPONSES
     )
 
-    # Obtaining the specific message to return to the user
-    chat_answer = chat_response['choices'][0]['message']['content']
+    if STREAM_RESPONSES:
 
-    # Appending the user prompt and answer to the chatbot interaction
-    chatbot.append((user_prompt, chat_answer))
+        # Adding an empty answer to the chatbot that will be filled in as the chunks arrive
+        chatbot.append(chat_turn.to_chatbot_row())
 
-    # Appending the chat answer to the chat flow sent to OpenAI
-    chat_flow.append({'role': 'assistant', 'content': chat_answer})
+        # Iterating over the chunks as they arrive, growing the answer message and showing it to the user each time
+        async for chunk in chat_response:
+            chat_turn.answer.content += chunk['choices'][0]['delta'].get('content', '')
+            chatbot[-1] = chat_turn.to_chatbot_row()
+            yield '', chatbot, conversation_id
 
-    # Clearing the prompt for the next user input
-    user_prompt = ''
+    else:
+
+        # Obtaining the specific message to return to the user
+        chat_turn.answer.content = chat_response['choices'][0]['message']['content']
 
-    return user_prompt, chatbot
+        # Appending the user prompt and answer to the chatbot interaction, reading both from the turn's messages
+        chatbot.append(chat_turn.to_chatbot_row())
+
+    # Appending the very same answer message to the stored conversation only once the full answer is in
+    await asyncio.to_thread(conversation_sessions.add_message, conversation_id, chat_turn.answer)
+
+    # Clearing the prompt for the next user input
+    yield '', chatbot, conversation_id
 
 
 
@@ -148,15 +142,18 @@ with gr.Blocks() as chat_ui:
                              show_label = False)
     start_new_convo_button = gr.Button('Start New Conversation')
 
+    # Keeping only the ID of each browser session's stored conversation in the session, so concurrent users never share a history
+    conversation_id = gr.State(None)
+
     # Defining the behavior for what occurs when the user hits "Enter" after typing a prompt
     user_prompt.submit(fn = process_prompt,
-                       inputs = [user_prompt, chatbot],
-                       outputs = [user_prompt, chatbot])
+                       inputs = [user_prompt, chatbot, conversation_id],
+                       outputs = [user_prompt, chatbot, conversation_id])
 
     # Defining the behavior for what occurs when the "Start New Conversation" button is clicked
     start_new_convo_button.click(fn = clear_chat_interface,
                                  inputs = None,
-                                 outputs = chatbot,
+                                 outputs = [chatbot, conversation_id],
                                  queue = False)
 
 
@@ -165,8 +162,8 @@ with gr.Blocks() as chat_ui:
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    # Instantiating the initial chat flow used as a global variable
-    chat_flow = initiate_chat_flow()
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
 
-    # Launching the Gradio Chatbot
-    chat_ui.launch(share = True)
\ No newline at end of file
+    # Launching the Gradio Chatbot (queueing is required for the streamed responses)
+    chat_ui.queue(concurrency_count = QUEUE_CONCURRENCY).launch(share = True)
\ No newline at end of file
@@ -1,62 +1,55 @@
 # Importing the necessary Python libraries
-import re
-import yaml
-import openai
 import inquirer
+from chat_messages import ChatMessage, serialize_chat_flow
+from conversation_store import ConversationSessions, SQLiteConversationStore
+from sensitive_data import check_sensitive_data, redact_sensitive_data
+from request_scheduler import INTERACTIVE_PRIORITY, scheduled_api_call
 
 
 
 ## API INSTANTIATION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
 
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Setting whether sensitive data is masked out of a prompt and the rest sent on, rather than the whole prompt being rejected
+REDACT_SENSITIVE_DATA = True
+
+# Setting the system prompt every conversation opens with
+SYSTEM_PROMPT = 'You are an assistant that speaks like Jar Jar Binks from Star Wars.'
+
+# Keeping every conversation in the on-disk store, so a conversation can be picked back up after the script is restarted
+conversation_sessions = ConversationSessions(SQLiteConversationStore())
 
 
 
 ## HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def initiate_chat_flow():
+def initiate_conversation():
     '''
-    Initiates a new chat flow
+    Initiates a conversation, offering to pick the last conversation back up if there is one in the store
 
     Inputs:
         - N/A
 
     Returns:
-        - chat_flow (list): A newly initiated chat flow
-    '''
-
-    chat_flow = [
-        {'role': 'system', 'content': 'You are an assistant that speaks like Jar Jar Binks from Star Wars.'}
-    ]
-
-    return chat_flow
-
-
-
-def check_sensitive_data(user_prompt):
-    '''
-    Checks the user's prompt to see if any sensitive information has been pass in via the prompt
-
-    Inputs:
-        - user_prompt (str): The user's inputted prompt
-
-    Returns:
-        - has_sensitive_data (bool): A boolean value indicating if the prompt contains sensitive data
+        - conversation_id (str): The ID of the stored conversation to continue
     '''
 
-    # Establishing a bit of regex to catch social security numbers
-    ssn_regex = r'\b(?!000)(?!666)(?!9\d{2})\d{3}[-]?(?!00)\d{2}[-]?(?!0000)\d{4}\b'
+    latest_conversation_id = conversation_sessions.conversation_store.get_latest_conversation_id()
 
-    # Checking to see if there is a match based on the regex
-    has_sensitive_data = bool(re.search(ssn_regex, user_prompt))
+    if latest_conversation_id is not None:
+        resume_choice = [
+            inquirer.List(
+                'resume_choice',
+                message = 'Would you like to pick up your last conversation where you left off?',
+                choices = ['Yes', 'Start New Conversation']
+            )
+        ]
+        if inquirer.prompt(resume_choice)['resume_choice'] == 'Yes':
+            return latest_conversation_id
 
-    return has_sensitive_data
+    return conversation_sessions.start_conversation(SYSTEM_PROMPT)
 
 
 
@@ -93,8 +86,8 @@ if __name__ == "__main__":
     # Printing a welcome statement
     print('Welcome to my ChatGPT Python script! Enter a prompt to begin the conversation.')
 
-    # Starting an initial chat flow
-    chat_flow = initiate_chat_flow()
+    # Starting an initial conversation (or picking the last one back up)
+    conversation_id = initiate_conversation()
 
     # Starting a reiterating loop for the prompts
     while True:
@@ -102,39 +95,41 @@ if __name__ == "__main__":
         # Retrieving the prompt input from the user
         user_prompt = input('What would you like to ask?\n')
 
-        # Checking the prompt for any sensitive data
-        has_sensitive_data = check_sensitive_data(user_prompt)
+        # Masking any sensitive data out of the prompt in place and letting the user know what was sent in its place
+        if REDACT_SENSITIVE_DATA:
+            user_prompt, sensitive_spans = redact_sensitive_data(user_prompt)
+            if sensitive_spans:
+                print(f'Your prompt appears to have sensitive data in the body of the text, so it was masked before sending:\n{user_prompt}\n')
 
-        # Prompting the user to submit a new prompt without sensitive data if sensitive data is present
-        if has_sensitive_data:
+        # Otherwise prompting the user to submit a new prompt without sensitive data if sensitive data is present
+        elif check_sensitive_data(user_prompt):
             print('Your prompt appears to have sensitive data in the body of the text. Please remove this sensitive data and submit a new prompt.\n')
             continue
 
-        # Appending the user prompt to the chat flow
-        chat_flow.append({'role': 'user', 'content': user_prompt})
+        # Appending the user prompt to the stored conversation and getting back its recent window, trimmed to the token budget
+        chat_flow = conversation_sessions.add_message(conversation_id, ChatMessage('user', user_prompt))
 
         # Obtaining the response from the API
-        chat_response = openai.ChatCompletion.create(
+        chat_response = scheduled_api_call(
+            openai.ChatCompletion.create,
+            priority = INTERACTIVE_PRIORITY,
             model = 'gpt-3.5-turbo',
-            messages = chat_flow
+            messages = serialize_chat_flow(chat_flow)
         )
 
-        # Printing ChatGPT's response back to the user
-        print(f"\nChatGPT's response: {chat_response['choices'][0]['message']['content']}\n")
+        # Printing ChatGPT's response back to the user and appending it to the stored conversation for continued conversation
+        chat_answer = chat_response['choices'][0]['message']['content']
+        print(f"\nChatGPT's response: {chat_answer}\n")
+        conversation_sessions.add_message(conversation_id, ChatMessage('assistant', chat_answer))
 
         # Prompting the user if they would like to continue the current chat, start a new one, or end the program
         next_action = prompt_next_choice()
 
         # Taking the appropriate action based on the user's next desired action
-        if next_action == 'Yes':
-
-            # Appending the result of the chat response to the chat flow for continued conversation
-            chat_flow.append({'role': 'assistant', 'content': chat_response['choices'][0]['message']['content']})
-
-        elif next_action == 'Start New Conversation':
+        if next_action == 'Start New Conversation':
 
-            # Re-initiating the chat flow
-            chat_flow = initiate_chat_flow()
+            # Starting a new conversation in the store
+            conversation_id = conversation_sessions.start_conversation(SYSTEM_PROMPT)
 
         elif next_action == 'End Program':
             exit(0)
\ No newline at end of file
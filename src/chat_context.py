@@ -0,0 +1,117 @@
+# Importing the necessary Python libraries
+from functools import lru_cache
+
+# tiktoken gives exact token counts but is optional; a character-based estimate is used if it is not installed
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+
+## CONTEXT WINDOW SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the default number of prompt tokens we are willing to send on each request
+DEFAULT_MAX_PROMPT_TOKENS = 3000
+
+# Setting the number of tokens OpenAI adds around every message and to prime the reply (per the OpenAI cookbook)
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Setting the rough number of characters per token used when tiktoken is not available
+CHARS_PER_TOKEN = 4
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+@lru_cache(maxsize = 1)
+def get_encoding():
+    '''
+    Loads the tiktoken encoding used by the chat models, if tiktoken is installed
+
+    Inputs:
+        - N/A
+
+    Returns:
+        - encoding (tiktoken Encoding): The encoding for the chat models, or None if tiktoken is unavailable
+    '''
+
+    if tiktoken is None:
+        return None
+
+    return tiktoken.get_encoding('cl100k_base')
+
+
+
+@lru_cache(maxsize = 4096)
+def count_message_tokens(role, content):
+    '''
+    Counts the tokens a single chat message takes up, caching the result so each message is only ever counted once
+
+    Inputs:
+        - role (str): The role of the message (system, user, or assistant)
+        - content (str): The text content of the message
+
+    Returns:
+        - num_tokens (int): The number of tokens the message contributes to a request
+    '''
+
+    encoding = get_encoding()
+
+    # Falling back to a character-based estimate if tiktoken is unavailable
+    if encoding is None:
+        return TOKENS_PER_MESSAGE + (len(role) + len(content)) // CHARS_PER_TOKEN + 1
+
+    return TOKENS_PER_MESSAGE + len(encoding.encode(role)) + len(encoding.encode(content))
+
+
+
+def count_chat_flow_tokens(chat_flow):
+    '''
+    Counts the total prompt tokens a chat flow will take up when sent to the API
+
+    Inputs:
+        - chat_flow (list): The chat flow that will be sent to the API
+
+    Returns:
+        - num_tokens (int): The number of prompt tokens for the chat flow
+    '''
+
+    return TOKENS_PER_REPLY + sum(count_message_tokens(message['role'], message['content']) for message in chat_flow)
+
+
+
+def fit_chat_flow_to_budget(chat_flow, max_tokens = DEFAULT_MAX_PROMPT_TOKENS):
+    '''
+    Trims the oldest turns from a chat flow so that it fits within a token budget, always keeping the system prompt
+
+    Inputs:
+        - chat_flow (list): The chat flow, starting with the system prompt (as API message dicts or ChatMessage objects)
+        - max_tokens (int): The maximum number of prompt tokens to send to the API (default = DEFAULT_MAX_PROMPT_TOKENS)
+
+    Returns:
+        - chat_flow (list): The chat flow trimmed down to the most recent messages that fit the budget
+    '''
+
+    # Separating the system prompt, which must always be kept, from the rest of the conversation
+    system_messages = [message for message in chat_flow[:1] if message['role'] == 'system']
+    conversation = chat_flow[len(system_messages):]
+
+    # Starting the budget off with what the system prompt and reply priming already take up
+    used_tokens = count_chat_flow_tokens(system_messages)
+
+    # Walking backwards from the newest message, keeping messages until the budget runs out
+    kept_messages = []
+    for message in reversed(conversation):
+        message_tokens = count_message_tokens(message['role'], message['content'])
+        if kept_messages and used_tokens + message_tokens > max_tokens:
+            break
+        used_tokens += message_tokens
+        kept_messages.append(message)
+
+    # Making sure the kept conversation does not open with a dangling assistant reply
+    while len(kept_messages) > 1 and kept_messages[-1]['role'] == 'assistant':
+        kept_messages.pop()
+
+    return system_messages + kept_messages[::-1]
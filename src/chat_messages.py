@@ -0,0 +1,71 @@
+# Importing the necessary Python libraries
+import sys
+
+
+
+## MESSAGE SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Keeping a single interned copy of each role, so every message in every conversation points at the same few strings
+ROLES = {role: sys.intern(role) for role in ['system', 'user', 'assistant']}
+
+
+
+## CHAT MESSAGES
+## ---------------------------------------------------------------------------------------------------------------------
+class ChatMessage:
+    '''
+    A compact chat message holding just its role and text, which can still be read like an API message (e.g. message['content'])
+    '''
+
+    __slots__ = ('role', 'content')
+
+    def __init__(self, role, content):
+        self.role = ROLES.get(role) or sys.intern(role)
+        self.content = content
+
+    def __getitem__(self, key):
+        if key not in ChatMessage.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        return isinstance(other, ChatMessage) and self.role == other.role and self.content == other.content
+
+    def __repr__(self):
+        return f'ChatMessage({self.role!r}, {self.content!r})'
+
+    def to_api(self):
+        return {'role': self.role, 'content': self.content}
+
+
+
+class ChatTurn:
+    '''
+    One exchange shown in the chatbot, pointing at the same messages that are sent to the API rather than copies of their text
+    '''
+
+    __slots__ = ('prompt', 'answer')
+
+    def __init__(self, prompt, answer):
+        self.prompt = prompt
+        self.answer = answer
+
+    def to_chatbot_row(self):
+        return (self.prompt.content, self.answer.content)
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def serialize_chat_flow(chat_flow):
+    '''
+    Serializes a chat flow into the list of dicts the API expects, only at the moment it is sent
+
+    Inputs:
+        - chat_flow (list): The chat flow, made up of ChatMessage objects
+
+    Returns:
+        - api_messages (list): The chat flow as API messages
+    '''
+
+    return [message.to_api() for message in chat_flow]
@@ -1,28 +1,28 @@
 # Importing the necessary Python libraries
-import yaml
-import openai
+import asyncio
 import gradio as gr
-from io import BytesIO
-from base64 import b64decode
-from PIL import Image
+from image_io import save_b64_image, normalize_upload_image
+from response_cache import async_cached_api_call
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## OPENAI CONNECTION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
+from request_coalescing import async_coalesced_api_call
 
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Setting the number of similar images to generate, and how many of them to ask DALL-E for in each concurrent request
+NUM_VARIATIONS = 5
+VARIATIONS_PER_REQUEST = 1
 
 
 
 ## GRADIO HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def generate_image(user_prompt):
+@instrumented_handler
+async def generate_image(user_prompt):
     '''
     Generates an image using the DALL-E API per the user's prompt
 
@@ -30,56 +30,81 @@ def generate_image(user_prompt):
         - user_prompt (str): A body of text describing what the user would like to see
 
     Returns:
-        - dalle_image (PIL): The image generated by DALL-E
+        - dalle_image (str): The path to the PNG image generated by DALL-E
     '''
 
     # Checking that the user prompt does not exceed 1000 character
     if len(user_prompt) > 1000:
         raise gr.Error('Input prompt cannot exceed 1000 characters.')
     
-    # Using DALL-E to generate the image as a base64 encoded object
-    openai_response = openai.Image.create(
+    # Using DALL-E to generate the image as a base64 encoded object, reusing the cached image if this prompt has been seen before
+    openai_response = await async_cached_api_call(
+        openai.Image.acreate,
         prompt = user_prompt,
         n = 1,
         size = '1024x1024',
         response_format = 'b64_json'
     )
 
-    # Decoding the base64 encoded object into a PIL image
-    dalle_image = Image.open(BytesIO(b64decode(openai_response['data'][0]['b64_json'])))
+    # Decoding the base64 encoded object straight into a PNG file that Gradio can serve without re-encoding it (off the event loop)
+    dalle_image = await asyncio.to_thread(save_b64_image, openai_response['data'][0]['b64_json'])
 
     return dalle_image
 
 
 
-def generate_similar_images(upload_image):
+@instrumented_handler
+async def generate_similar_images(upload_image):
     '''
-    Generates similar images based on an input image
+    Generates similar images based on an input image, showing each image in the gallery as soon as it is ready
 
     Inputs:
-        - upload_image (PIL): An image uploaded by the user that will be the basis to create similar images
+        - upload_image (str): The path to the image uploaded by the user that will be the basis to create similar images
 
-    Returns:
-        - output_gallery (list): A list of images that will be returned in a display gallery
+    Yields:
+        - output_gallery (list): A list of PNG image paths that will be returned in a display gallery, growing as the images arrive
     '''
-    # Using DALL-E to generate similar images compared to the one uploaded by the user
-    openai_response = openai.Image.create_variation(
-        image = open(upload_image, 'rb'),
-        n = 5,
-        size = '1024x1024',
-        response_format = 'b64_json'
-    )
 
-    # Creating an empty list to hold all the images for the output gallery
+    # Checking the uploaded image and normalizing it into a square PNG under 4MB before anything is sent to DALL-E (off the
+    # event loop, since the resizing and PNG encoding are CPU bound)
+    try:
+        upload_image_bytes = await asyncio.to_thread(normalize_upload_image, upload_image, size = '1024x1024')
+    except ValueError as error:
+        raise gr.Error(str(error))
+
+    # Splitting the variations into smaller concurrent requests to DALL-E, each returning a base64 encoded object (numbering
+    # the requests so they are not merged with each other, only with the same requests from anyone uploading the same image)
+    variation_requests = [
+        async_coalesced_api_call(
+            openai.Image.acreate_variation,
+            request_slot = num_requested,
+            image = upload_image_bytes,
+            n = min(VARIATIONS_PER_REQUEST, NUM_VARIATIONS - num_requested),
+            size = '1024x1024',
+            response_format = 'b64_json'
+        )
+        for num_requested in range(0, NUM_VARIATIONS, VARIATIONS_PER_REQUEST)
+    ]
+
+    # Creating a list to hold all the images as the output gallery
     output_gallery = []
+    request_errors = []
 
-    # Iterating through all the images returned by DALL-E
-    for image in openai_response['data']:
+    # Adding the images to the gallery as each request comes back, carrying on past any request that fails
+    for variation_request in asyncio.as_completed(variation_requests):
+        try:
+            openai_response = await variation_request
+        except Exception as error:
+            request_errors.append(error)
+            continue
 
-        # Appending the DALL-E generated image to the gallery
-        output_gallery.append(Image.open(BytesIO(b64decode(image['b64_json']))))
+        for image in openai_response['data']:
+            output_gallery.append(await asyncio.to_thread(save_b64_image, image['b64_json']))
+        yield output_gallery
 
-    return output_gallery
+    # Letting the user know if none of the requests succeeded
+    if not output_gallery:
+        raise gr.Error(f'DALL-E could not generate any similar images: {request_errors[0]}')
 
 
 
@@ -118,7 +143,7 @@ with gr.Blocks(title = 'DALL-E Combined UI', theme = 'base') as combined_dalle_u
             similar_image_header = gr.Markdown('''
             # DALL-E Image Variation Generator
 
-            Upload your own `.png` image (< 4MB) to have DALL-E generate a gallery of similar images.
+            Upload your own image to have DALL-E generate a gallery of similar images. It will be cropped to a square `.png` under 4MB for you.
             '''
             )
 
@@ -147,5 +172,8 @@ with gr.Blocks(title = 'DALL-E Combined UI', theme = 'base') as combined_dalle_u
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    # Launching the Gradio UI
-    combined_dalle_ui.launch()
\ No newline at end of file
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
+
+    # Launching the Gradio UI (queueing is required for the images to stream into the gallery)
+    combined_dalle_ui.queue().launch()
\ No newline at end of file
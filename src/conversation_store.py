@@ -0,0 +1,307 @@
+# Importing the necessary Python libraries
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from chat_messages import ChatMessage
+from chat_context import DEFAULT_MAX_PROMPT_TOKENS, count_message_tokens, fit_chat_flow_to_budget
+
+
+
+## STORE SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting where conversations are stored on disk (NOT pushed to GitHub)
+CONVERSATION_DB_PATH = os.environ.get('CONVERSATION_DB_PATH', '../conversations/conversations.db')
+
+# Setting how many conversations are kept in memory at once before the least recently used are evicted
+MAX_ACTIVE_SESSIONS = 1000
+
+# Setting how long a conversation can sit idle before it is evicted from memory, in seconds
+SESSION_IDLE_SECONDS = 30 * 60
+
+# Setting how many messages are read from the store at a time while lazily loading a conversation's recent window
+LOAD_PAGE_SIZE = 32
+
+
+
+## CONVERSATION STORES
+## ---------------------------------------------------------------------------------------------------------------------
+class ConversationStore(ABC):
+    '''
+    The interface every conversation store backend implements, where messages are only ever appended and never rewritten
+    '''
+
+    @abstractmethod
+    def create_conversation(self, system_prompt):
+        '''
+        Starts a new conversation, returning its ID
+        '''
+
+    @abstractmethod
+    def append_message(self, conversation_id, message):
+        '''
+        Appends a ChatMessage to the end of a conversation, raising a KeyError if there is no such conversation
+        '''
+
+    @abstractmethod
+    def load_recent_messages(self, conversation_id, max_tokens = DEFAULT_MAX_PROMPT_TOKENS):
+        '''
+        Loads the system prompt and as much of the end of a conversation as fits the token budget, or None if there is no such conversation
+        '''
+
+    @abstractmethod
+    def get_latest_conversation_id(self):
+        '''
+        Gets the ID of the most recently started conversation, or None if there are none yet
+        '''
+
+
+
+class SQLiteConversationStore(ConversationStore):
+    '''
+    A conversation store kept in a single SQLite file, with one row per message
+    '''
+
+    def __init__(self, db_path = CONVERSATION_DB_PATH):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok = True)
+
+        self.connection = sqlite3.connect(db_path, check_same_thread = False, isolation_level = None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            # Using write-ahead logging so appends never block the reads of other sessions
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('PRAGMA synchronous = NORMAL')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS conversations (
+                    conversation_id TEXT PRIMARY KEY,
+                    system_prompt TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    next_turn INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            self.connection.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    conversation_id TEXT NOT NULL,
+                    turn INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    num_tokens INTEGER NOT NULL,
+                    PRIMARY KEY (conversation_id, turn)
+                ) WITHOUT ROWID
+            ''')
+
+    def create_conversation(self, system_prompt):
+        '''
+        Starts a new conversation
+
+        Inputs:
+            - system_prompt (str): The system prompt the conversation opens with
+
+        Returns:
+            - conversation_id (str): The ID of the new conversation
+        '''
+
+        conversation_id = uuid.uuid4().hex
+
+        with self.lock:
+            self.connection.execute(
+                'INSERT INTO conversations (conversation_id, system_prompt, created_at) VALUES (?, ?, ?)',
+                (conversation_id, system_prompt, time.time())
+            )
+
+        return conversation_id
+
+    def append_message(self, conversation_id, message):
+        '''
+        Appends a message to the end of a conversation, storing its token count so it never has to be counted again (raising a
+        KeyError if there is no such conversation)
+
+        Inputs:
+            - conversation_id (str): The ID of the conversation
+            - message (ChatMessage): The message, with its role and content
+
+        Returns:
+            - N/A
+        '''
+
+        num_tokens = count_message_tokens(message['role'], message['content'])
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                conversation_row = self.connection.execute(
+                    'SELECT next_turn FROM conversations WHERE conversation_id = ?', (conversation_id,)
+                ).fetchone()
+                if conversation_row is None:
+                    raise KeyError(f'No conversation {conversation_id!r} in the store')
+                (turn,) = conversation_row
+                self.connection.execute(
+                    'UPDATE conversations SET next_turn = ? WHERE conversation_id = ?', (turn + 1, conversation_id)
+                )
+                self.connection.execute(
+                    'INSERT INTO messages (conversation_id, turn, role, content, num_tokens) VALUES (?, ?, ?, ?, ?)',
+                    (conversation_id, turn, message['role'], message['content'], num_tokens)
+                )
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+            self.connection.execute('COMMIT')
+
+    def load_recent_messages(self, conversation_id, max_tokens = DEFAULT_MAX_PROMPT_TOKENS):
+        '''
+        Loads only as much of the end of a conversation as fits the token budget, reading the newest messages first a page at a time
+
+        Inputs:
+            - conversation_id (str): The ID of the conversation
+            - max_tokens (int): The maximum number of prompt tokens the loaded window may take up (default = DEFAULT_MAX_PROMPT_TOKENS)
+
+        Returns:
+            - chat_flow (list): The system prompt followed by the most recent messages that fit the budget, or None if there is no such conversation
+        '''
+
+        with self.lock:
+            conversation_row = self.connection.execute(
+                'SELECT system_prompt, next_turn FROM conversations WHERE conversation_id = ?', (conversation_id,)
+            ).fetchone()
+            if conversation_row is None:
+                return None
+
+            # Walking backwards from the newest message using the stored token counts, stopping as soon as the budget runs out
+            system_message = ChatMessage('system', conversation_row[0])
+            used_tokens = count_message_tokens(system_message['role'], system_message['content'])
+            recent_messages = []
+            before_turn = conversation_row[1]
+            while used_tokens <= max_tokens:
+                page_rows = self.connection.execute(
+                    'SELECT turn, role, content, num_tokens FROM messages WHERE conversation_id = ? AND turn < ? ORDER BY turn DESC LIMIT ?',
+                    (conversation_id, before_turn, LOAD_PAGE_SIZE)
+                ).fetchall()
+                for before_turn, role, content, num_tokens in page_rows:
+                    recent_messages.append(ChatMessage(role, content))
+                    used_tokens += num_tokens
+                    if used_tokens > max_tokens:
+                        break
+                if len(page_rows) < LOAD_PAGE_SIZE:
+                    break
+
+        # Applying the same trimming rules as every other request, so a resumed conversation is sent exactly as it would have been
+        return fit_chat_flow_to_budget([system_message] + recent_messages[::-1], max_tokens)
+
+    def get_latest_conversation_id(self):
+        '''
+        Gets the most recently started conversation
+
+        Inputs:
+            - N/A
+
+        Returns:
+            - conversation_id (str): The ID of the conversation, or None if there are none yet
+        '''
+
+        with self.lock:
+            latest_row = self.connection.execute(
+                'SELECT conversation_id FROM conversations ORDER BY created_at DESC LIMIT 1'
+            ).fetchone()
+
+        return latest_row[0] if latest_row else None
+
+
+
+## CONVERSATION SESSIONS
+## ---------------------------------------------------------------------------------------------------------------------
+class ConversationSessions:
+    '''
+    Keeps the recent window of each active conversation in memory in front of a store, evicting idle conversations back to it
+    '''
+
+    def __init__(self, conversation_store, max_sessions = MAX_ACTIVE_SESSIONS, idle_seconds = SESSION_IDLE_SECONDS, max_tokens = DEFAULT_MAX_PROMPT_TOKENS):
+        self.conversation_store = conversation_store
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.max_tokens = max_tokens
+        self.active_sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict_idle_sessions(self):
+        # Dropping the least recently used windows first (every message is already in the store, so nothing is lost)
+        now = time.monotonic()
+        while self.active_sessions:
+            conversation_id, (last_used, _) = next(iter(self.active_sessions.items()))
+            if len(self.active_sessions) <= self.max_sessions and now - last_used < self.idle_seconds:
+                break
+            del self.active_sessions[conversation_id]
+
+    def start_conversation(self, system_prompt):
+        '''
+        Starts a new conversation in the store and keeps its (so far empty) window in memory
+
+        Inputs:
+            - system_prompt (str): The system prompt the conversation opens with
+
+        Returns:
+            - conversation_id (str): The ID of the new conversation
+        '''
+
+        conversation_id = self.conversation_store.create_conversation(system_prompt)
+
+        with self.lock:
+            self.active_sessions[conversation_id] = (time.monotonic(), [ChatMessage('system', system_prompt)])
+            self.evict_idle_sessions()
+
+        return conversation_id
+
+    def get_chat_flow(self, conversation_id):
+        '''
+        Gets the recent window of a conversation, loading it lazily from the store if it is not in memory
+
+        Inputs:
+            - conversation_id (str): The ID of the conversation
+
+        Returns:
+            - chat_flow (list): The system prompt followed by the most recent messages that fit the token budget, or None if there is no such conversation
+        '''
+
+        with self.lock:
+            active_session = self.active_sessions.pop(conversation_id, None)
+
+        chat_flow = active_session[1] if active_session else self.conversation_store.load_recent_messages(conversation_id, self.max_tokens)
+        if chat_flow is None:
+            return None
+
+        with self.lock:
+            self.active_sessions[conversation_id] = (time.monotonic(), chat_flow)
+            self.evict_idle_sessions()
+
+        return chat_flow
+
+    def add_message(self, conversation_id, message):
+        '''
+        Appends a message to a conversation in the store and to its window in memory, trimming the window to the token budget
+        (raising a KeyError if there is no such conversation, e.g. an ID kept from a different store)
+
+        Inputs:
+            - conversation_id (str): The ID of the conversation
+            - message (ChatMessage): The message, whose text is shared with (not copied from) whatever else shows it
+
+        Returns:
+            - chat_flow (list): The conversation's recent window of ChatMessage objects with the message added
+        '''
+
+        # Getting the window before the message is written, so a lazily loaded window does not pick the message up twice
+        chat_flow = self.get_chat_flow(conversation_id)
+        if chat_flow is None:
+            raise KeyError(f'No conversation {conversation_id!r} in the store')
+
+        self.conversation_store.append_message(conversation_id, message)
+
+        chat_flow = fit_chat_flow_to_budget(chat_flow + [message], self.max_tokens)
+
+        with self.lock:
+            self.active_sessions[conversation_id] = (time.monotonic(), chat_flow)
+
+        return chat_flow
@@ -1,19 +1,16 @@
 # Importing the necessary Python libraries
-import yaml
-import openai
+import re
+import asyncio
 import gradio as gr
+from response_cache import async_cached_api_call
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## OPENAI CONNECTION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
-
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
 
 # Setting the OpenAI model selection (may adjust later to be user changeable for those lucky folks out there with GPT-4 access ;) )
 openai_model = 'gpt-4'
@@ -21,6 +18,16 @@ openai_model = 'gpt-4'
 # Setting the number of words to return in a response
 NUM_WORDS = 300
 
+# Setting how much of the earlier conversation each philosopher keeps in their rolling summary
+SUMMARY_ROUNDS = 4
+SUMMARY_WORDS = 40
+
+# Keeping track of the conversation openers being speculatively prefetched in the background
+prefetched_openers = {}
+
+# Setting the most openers that may be prefetched and waiting on the user at any one time, across every session
+MAX_PREFETCHED_OPENERS = 16
+
 
 
 ## PROMPT ENGINEERING
@@ -39,6 +46,9 @@ PHILOSOPHERS = [
     'Socrates'
 ]
 
+# Setting the header that marks the rolling summary of earlier rounds in a philosopher's chat flow
+SUMMARY_HEADER = 'Here is a summary of how the conversation has gone since your opening:'
+
 # Setting a list of comedians, just to be able to get better results from the model
 COMEDIANS = [
     'Duncan Trussell',
@@ -50,19 +60,102 @@ COMEDIANS = [
 
 ## GRADIO HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, convo_chatbot, rounds = 2):
+async def get_philosopher_response(philosopher_chat_flow, prompt):
     '''
-    Simulates a conversation between two phiosopher using Generative AI
+    Adds a prompt to a philosopher's chat flow and gets the philosopher's response from OpenAI's API
 
     Inputs:
-        - philosopher_1 (str): The name of the first philosopher, who will begin the conversation
+        - philosopher_chat_flow (list): The chat flow of the philosopher who is about to speak
+        - prompt (str): The prompt engineered for the philosopher's next turn
+
+    Returns:
+        - response (str): The philosopher's response, which is also appended to their chat flow
+    '''
+
+    # Folding older turns into a rolling summary so the prompt size stays roughly constant however many rounds there are
+    compact_chat_flow(philosopher_chat_flow)
+
+    philosopher_chat_flow.append({'role': 'user', 'content': prompt})
+    response = (await async_cached_api_call(
+        openai.ChatCompletion.acreate,
+        model = openai_model,
+        messages = philosopher_chat_flow
+    ))['choices'][0]['message']['content']
+    philosopher_chat_flow.append({'role': 'assistant', 'content': response})
+
+    return response
+
+
+
+def summarize_turn(message):
+    '''
+    Boils a single turn of the conversation down to a short gist for the rolling summary
+
+    Inputs:
+        - message (dict): A message from a philosopher's chat flow
+
+    Returns:
+        - gist (str): A short gist of the turn, or an empty string if there is nothing worth keeping
+    '''
+
+    # Pulling the other philosopher's quoted reply out of our engineered prompts, since the instructions around it are boilerplate
+    if message['role'] == 'user':
+        quoted_reply = re.search(r'"(.+)"', message['content'], flags = re.DOTALL)
+        if quoted_reply is None:
+            return ''
+        speaker, text = 'They said', quoted_reply.group(1)
+    else:
+        speaker, text = 'You said', message['content']
+
+    # Keeping only the first handful of words of the turn
+    words = text.split()
+    gist = ' '.join(words[:SUMMARY_WORDS]) + (' ...' if len(words) > SUMMARY_WORDS else '')
+
+    return f'{speaker}: {gist}'
+
+
+
+def compact_chat_flow(philosopher_chat_flow):
+    '''
+    Compacts a philosopher's chat flow in place to the opening exchange, a rolling summary of the earlier rounds and the latest exchange
+
+    Inputs:
+        - philosopher_chat_flow (list): The chat flow of the philosopher who is about to speak
+
+    Returns:
+        - N/A
+    '''
+
+    # Splitting out the opening exchange (which sets up who the philosopher is), any existing summary and the rest of the turns
+    opening_exchange = philosopher_chat_flow[:2]
+    has_summary = len(philosopher_chat_flow) > 2 and philosopher_chat_flow[2]['content'].startswith(SUMMARY_HEADER)
+    summary_lines = philosopher_chat_flow[2]['content'].splitlines()[1:] if has_summary else []
+    turns = philosopher_chat_flow[3 if has_summary else 2:]
+
+    # Leaving the chat flow alone until there is more than the latest exchange to fold away
+    if len(turns) <= 2:
+        return
+
+    # Adding the older turns to the rolling summary, keeping only the most recent rounds of it
+    summary_lines += [gist for gist in map(summarize_turn, turns[:-2]) if gist]
+    summary_lines = summary_lines[-2 * SUMMARY_ROUNDS:]
+    summary_message = {'role': 'user', 'content': '\n'.join([SUMMARY_HEADER] + summary_lines)}
+
+    philosopher_chat_flow[:] = opening_exchange + [summary_message] + turns[-2:]
+
+
+
+def format_philosophers(philosopher_1, philosopher_2):
+    '''
+    Formats the philosophers' names for prompting, noting which of them are also comedians
+
+    Inputs:
+        - philosopher_1 (str): The name of the first philosopher
         - philosopher_2 (str): The name of the second philosopher
-        - convo_topic (str): The topic of conversation about to take place between the philosophers
-        - convo_chatbot (Gradio Chatbot): The chatbot interface that will hold the dialogue betweent the two philosophers
-        - rounds (int): The number of rounds of conversation that will take place (default = 2)
 
     Returns:
-        - convo_chatbot (Gradio Chatbot): The chatbot interface that holds the dialogue betweent the two philosophers
+        - philosopher_1 (str): The formatted name of the first philosopher
+        - philosopher_2 (str): The formatted name of the second philosopher
     '''
 
     # Checking if the philosopher is also a comedian
@@ -71,27 +164,167 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
     if philosopher_2 in COMEDIANS:
         philosopher_2 = 'and comedian ' + philosopher_2
 
-    # Instantiating chat flows for each respective philosopher
+    return philosopher_1, philosopher_2
+
+
+
+async def get_opener(philosopher_1_opener_prompt):
+    '''
+    Gets the opening of the dialogue from philosopher 1
+
+    Inputs:
+        - philosopher_1_opener_prompt (str): The prompt engineered for philosopher 1's opening
+
+    Returns:
+        - philosopher_1_chat_flow (list): Philosopher 1's chat flow with the opening already in it
+        - philosopher_1_opener (str): Philosopher 1's opening
+    '''
+
     philosopher_1_chat_flow = []
-    philosopher_2_chat_flow = []
+    philosopher_1_opener = await get_philosopher_response(philosopher_1_chat_flow, philosopher_1_opener_prompt)
 
-    # Prompt engineering the opening from philosopher 1
-    philosopher_1_opener_prompt = f'''
-    You are philosopher {philosopher_1} and are about to have a conversation with another philosopher, {philosopher_2}.
-    The topic of conversation is {convo_topic}.
-    You are first to speak.
-    Please give your opening as {philosopher_1}
-    Do not continue as {philosopher_2}.
-    Please keep your opening under {NUM_WORDS} words.
+    return philosopher_1_chat_flow, philosopher_1_opener
+
+
+
+def cancel_opener(opener_key):
     '''
+    Cancels a prefetched opener that nobody has picked up yet
 
-    # Simulating the opening of the dialogue with philsopher 1 kicking things off
-    philosopher_1_chat_flow.append({'role': 'user', 'content': philosopher_1_opener_prompt})
-    philosopher_1_opener = openai.ChatCompletion.create(
-        model = openai_model,
-        messages = philosopher_1_chat_flow
-    )['choices'][0]['message']['content']
-    philosopher_1_chat_flow.append({'role': 'assistant', 'content': philosopher_1_opener})
+    Inputs:
+        - opener_key (tuple): The philosopher 1, philosopher 2 and topic selections the opener was prefetched for
+
+    Returns:
+        - N/A
+    '''
+
+    opener_task = prefetched_openers.pop(opener_key, None)
+    if opener_task is not None:
+        opener_task.cancel()
+
+
+
+def retrieve_opener_error(opener_task):
+    '''
+    Retrieves the error from an opener that failed, so a prefetch nobody ended up waiting on does not log "Task exception was never retrieved"
+
+    Inputs:
+        - opener_task (asyncio Task): The finished opener task
+
+    Returns:
+        - N/A
+    '''
+
+    if not opener_task.cancelled():
+        opener_task.exception()
+
+
+
+def start_opener(philosopher_1, philosopher_2, convo_topic):
+    '''
+    Starts generating the opening from philosopher 1 in the background, since it only depends on the UI selections
+
+    Inputs:
+        - philosopher_1 (str): The name of the first philosopher, who will begin the conversation
+        - philosopher_2 (str): The name of the second philosopher
+        - convo_topic (str): The topic of conversation about to take place between the philosophers
+
+    Returns:
+        - opener_task (asyncio Task): A task resolving to philosopher 1's chat flow and opening
+    '''
+
+    opener_key = (philosopher_1, philosopher_2, convo_topic)
+
+    # Reusing an opener that has already been started for these same selections
+    if opener_key not in prefetched_openers:
+        philosopher_1, philosopher_2 = format_philosophers(philosopher_1, philosopher_2)
+
+        # Prompt engineering the opening from philosopher 1
+        philosopher_1_opener_prompt = f'''
+        You are philosopher {philosopher_1} and are about to have a conversation with another philosopher, {philosopher_2}.
+        The topic of conversation is {convo_topic}.
+        You are first to speak.
+        Please give your opening as {philosopher_1}
+        Do not continue as {philosopher_2}.
+        Please keep your opening under {NUM_WORDS} words.
+        '''
+
+        # Cancelling the oldest prefetched opener if lots of sessions are prefetching without simulating
+        if len(prefetched_openers) >= MAX_PREFETCHED_OPENERS:
+            cancel_opener(next(iter(prefetched_openers)))
+
+        # Simulating the opening of the dialogue with philsopher 1 kicking things off in the background
+        prefetched_openers[opener_key] = asyncio.ensure_future(get_opener(philosopher_1_opener_prompt))
+        prefetched_openers[opener_key].add_done_callback(retrieve_opener_error)
+
+    return prefetched_openers[opener_key]
+
+
+
+@instrumented_handler
+async def prefetch_opener(philosopher_1, philosopher_2, convo_topic, prefetched_opener_key):
+    '''
+    Speculatively prefetches the opener once all of the conversation selections have been filled in on the UI, cancelling the
+    session's previous prefetch if the selections have changed since
+
+    Inputs:
+        - philosopher_1 (str): The name of the first philosopher, who will begin the conversation
+        - philosopher_2 (str): The name of the second philosopher
+        - convo_topic (str): The topic of conversation about to take place between the philosophers
+        - prefetched_opener_key (tuple): The selections this session last prefetched an opener for, or None if it has not yet
+
+    Returns:
+        - prefetched_opener_key (tuple): The selections this session now has an opener prefetched for
+    '''
+
+    if not (philosopher_1 and philosopher_2 and convo_topic):
+        return prefetched_opener_key
+
+    opener_key = (philosopher_1, philosopher_2, convo_topic)
+    if prefetched_opener_key is not None and tuple(prefetched_opener_key) != opener_key:
+        cancel_opener(tuple(prefetched_opener_key))
+
+    start_opener(philosopher_1, philosopher_2, convo_topic)
+
+    return opener_key
+
+
+
+@instrumented_handler
+async def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, convo_chatbot, rounds = 2):
+    '''
+    Simulates a conversation between two phiosopher using Generative AI
+
+    Inputs:
+        - philosopher_1 (str): The name of the first philosopher, who will begin the conversation
+        - philosopher_2 (str): The name of the second philosopher
+        - convo_topic (str): The topic of conversation about to take place between the philosophers
+        - convo_chatbot (Gradio Chatbot): The chatbot interface that will hold the dialogue betweent the two philosophers
+        - rounds (int): The number of rounds of conversation that will take place (default = 2)
+
+    Yields:
+        - convo_chatbot (Gradio Chatbot): The chatbot interface holding the dialogue so far, updated after every turn
+    '''
+
+    # Picking up the opener from philosopher 1, which may already have been prefetched while the user filled in the UI
+    opener_task = start_opener(philosopher_1, philosopher_2, convo_topic)
+
+    # Handing the opener over to this conversation so that the next conversation gets a fresh one
+    prefetched_openers.pop((philosopher_1, philosopher_2, convo_topic), None)
+    philosopher_1_chat_flow, philosopher_1_opener = await opener_task
+
+    # Formatting the philosophers' names for the rest of the prompts
+    philosopher_1, philosopher_2 = format_philosophers(philosopher_1, philosopher_2)
+
+    # Starting a fresh conversation in the chatbot
+    convo_chatbot = []
+
+    # Showing the opener right away while philosopher 2 thinks about a response
+    convo_chatbot.append((philosopher_1_opener, None))
+    yield convo_chatbot
+
+    # Instantiating the chat flow for philosopher 2
+    philosopher_2_chat_flow = []
 
     # Prompt engineering the opening from philosopher 2
     philosopher_2_opener_prompt = f'''
@@ -105,15 +338,11 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
     '''
 
     # Simulating the opening response from philosopher 2 on hearing philosopher 1's opening
-    philosopher_2_chat_flow.append({'role': 'user', 'content': philosopher_2_opener_prompt})
-    philosopher_2_response = openai.ChatCompletion.create(
-        model = openai_model,
-        messages = philosopher_2_chat_flow
-    )['choices'][0]['message']['content']
-    philosopher_2_chat_flow.append({'role': 'assistant', 'content': philosopher_2_response})
+    philosopher_2_response = await get_philosopher_response(philosopher_2_chat_flow, philosopher_2_opener_prompt)
 
-    # Appending the opening interaction to the chatbot
-    convo_chatbot.append((philosopher_1_opener, philosopher_2_response))
+    # Completing the opening interaction in the chatbot
+    convo_chatbot[-1] = (philosopher_1_opener, philosopher_2_response)
+    yield convo_chatbot
 
     # Continuing a general back-and-forth based on number of rounds
     for _ in range(rounds):
@@ -127,13 +356,10 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
         Plase keep your response under {NUM_WORDS} words.
         '''
 
-        # Simulating the response from philosopher 1
-        philosopher_1_chat_flow.append({'role': 'user', 'content': philosopher_1_response_prompt})
-        philosopher_1_response = openai.ChatCompletion.create(
-            model = openai_model,
-            messages = philosopher_1_chat_flow
-        )['choices'][0]['message']['content']
-        philosopher_1_chat_flow.append({'role': 'assistant', 'content': philosopher_1_response})
+        # Simulating the response from philosopher 1 and showing it as soon as it is ready
+        philosopher_1_response = await get_philosopher_response(philosopher_1_chat_flow, philosopher_1_response_prompt)
+        convo_chatbot.append((philosopher_1_response, None))
+        yield convo_chatbot
 
         # Prompt engineering the continued conversation for philosopher 2
         philosopher_2_response_prompt = f'''
@@ -144,16 +370,10 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
         Plase keep your response under {NUM_WORDS} words.
         '''
 
-        # Simulating the response from philosopher 2
-        philosopher_2_chat_flow.append({'role': 'user', 'content': philosopher_2_response_prompt})
-        philosopher_2_response = openai.ChatCompletion.create(
-            model = openai_model,
-            messages = philosopher_2_chat_flow
-        )['choices'][0]['message']['content']
-        philosopher_2_chat_flow.append({'role': 'assistant', 'content': philosopher_2_response})
-
-        # Appending this round of conversation to the chatbot
-        convo_chatbot.append((philosopher_1_response, philosopher_2_response))
+        # Simulating the response from philosopher 2 and completing this round of conversation in the chatbot
+        philosopher_2_response = await get_philosopher_response(philosopher_2_chat_flow, philosopher_2_response_prompt)
+        convo_chatbot[-1] = (philosopher_1_response, philosopher_2_response)
+        yield convo_chatbot
 
     # Prompt engineering a close of the conversation instigated by philosopher 1
     philosopher_1_closer_prompt = f'''
@@ -165,12 +385,9 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
     '''
 
     # Simulating the closer from philosopher 1
-    philosopher_1_chat_flow.append({'role': 'user', 'content': philosopher_1_closer_prompt})
-    philosopher_1_closer = openai.ChatCompletion.create(
-        model = openai_model,
-        messages = philosopher_1_chat_flow
-    )['choices'][0]['message']['content']
-    philosopher_1_chat_flow.append({'role': 'assistant', 'content': philosopher_1_closer})
+    philosopher_1_closer = await get_philosopher_response(philosopher_1_chat_flow, philosopher_1_closer_prompt)
+    convo_chatbot.append((philosopher_1_closer, None))
+    yield convo_chatbot
 
     # Prompt engineering a close of the conversation, finally wrapping things up with philosopher 2
     philosopher_2_closer_prompt = f'''
@@ -179,18 +396,10 @@ def converse_amongst_philosophers(philosopher_1, philosopher_2, convo_topic, con
     Please bring this conversation to a close and keep your response under {NUM_WORDS} words.
     '''
 
-    # Simulating the closer from philosopher 2
-    philosopher_2_chat_flow.append({'role': 'user', 'content': philosopher_2_closer_prompt})
-    philosopher_2_closer = openai.ChatCompletion.create(
-        model = openai_model,
-        messages = philosopher_2_chat_flow
-    )['choices'][0]['message']['content']
-    philosopher_2_chat_flow.append({'role': 'assistant', 'content': philosopher_2_closer})
-
-    # Appending the closing remarks to the chatbot
-    convo_chatbot.append((philosopher_1_closer, philosopher_2_closer))
-
-    return convo_chatbot
+    # Simulating the closer from philosopher 2 and appending the closing remarks to the chatbot
+    philosopher_2_closer = await get_philosopher_response(philosopher_2_chat_flow, philosopher_2_closer_prompt)
+    convo_chatbot[-1] = (philosopher_1_closer, philosopher_2_closer)
+    yield convo_chatbot
 
 
 
@@ -221,6 +430,9 @@ with gr.Blocks(title = 'Philosophy Conversation Simulator', theme = 'base') as c
     # Creating a freeform textbox allowing the user to submit any topic they would like the participants to converse about
     convo_topic = gr.Textbox(label = 'Please enter an idea for a topic of conversation.',
                              placeholder = 'e.g. Chicago Style Pizza')
+
+    # Keeping track of the selections this session last prefetched an opener for
+    prefetched_opener_key = gr.State(None)
     
     # Creating the button to simulate the conversation
     simulate_conversation_button = gr.Button('Simulate Conversation')
@@ -231,8 +443,14 @@ with gr.Blocks(title = 'Philosophy Conversation Simulator', theme = 'base') as c
     # Defining the behavior for when the user clicks the "Simulate Conversation" button
     simulate_conversation_button.click(fn = converse_amongst_philosophers,
                                        inputs = [philosopher_1, philosopher_2, convo_topic, convo_chatbot],
-                                       outputs = [convo_chatbot],
-                                       queue = False)
+                                       outputs = [convo_chatbot])
+
+    # Prefetching the opener once the topic is entered (rather than on every dropdown change) so it is ready by the time the button is clicked
+    for convo_topic_event in [convo_topic.submit, convo_topic.blur]:
+        convo_topic_event(fn = prefetch_opener,
+                          inputs = [philosopher_1, philosopher_2, convo_topic, prefetched_opener_key],
+                          outputs = [prefetched_opener_key],
+                          queue = False)
 
 
 
@@ -241,8 +459,8 @@ with gr.Blocks(title = 'Philosophy Conversation Simulator', theme = 'base') as c
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    # Instantiating the initial chat flow used as a global variable
-    chat_flow = []
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
 
-    # Launching the Gradio UI
-    convo_sim.launch()
\ No newline at end of file
+    # Launching the Gradio UI (queueing is required for the conversation to stream in turn by turn)
+    convo_sim.queue().launch()
\ No newline at end of file
@@ -1,28 +1,23 @@
 # Importing the necessary Python libraries
-import yaml
-from io import BytesIO
-from PIL import Image
-from base64 import b64decode
-import openai
+import asyncio
 import gradio as gr
+from image_io import save_b64_image
+from response_cache import async_cached_api_call
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## OPENAI CONNECTION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
-
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
 
 
 
 ## GRADIO HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def generate_image(user_prompt):
+@instrumented_handler
+async def generate_image(user_prompt):
     '''
     Generates an image using the DALL-E API per the user's prompt
 
@@ -30,23 +25,24 @@ def generate_image(user_prompt):
         - user_prompt (str): A body of text describing what the user would like to see
 
     Returns:
-        - dalle_image (PIL): The image generated by DALL-E
+        - dalle_image (str): The path to the PNG image generated by DALL-E
     '''
 
     # Checking that the user prompt does not exceed 1000 characters
     if len(user_prompt) > 1000:
         raise gr.Error('Input prompt cannot exceed 1000 characters.')
 
-    # Using DALL-E to generate the image as a base64 encoded object
-    openai_response = openai.Image.create(
+    # Using DALL-E to generate the image as a base64 encoded object, reusing the cached image if this prompt has been seen before
+    openai_response = await async_cached_api_call(
+        openai.Image.acreate,
         prompt = user_prompt,
         n = 1,
         size = '1024x1024',
         response_format = 'b64_json'
     )
 
-    # Decoding the base64 encoded object into a PIL image
-    dalle_image = Image.open(BytesIO(b64decode(openai_response['data'][0]['b64_json'])))
+    # Decoding the base64 encoded object straight into a PNG file that Gradio can serve without re-encoding it (off the event loop)
+    dalle_image = await asyncio.to_thread(save_b64_image, openai_response['data'][0]['b64_json'])
 
     return dalle_image
 
@@ -79,5 +75,8 @@ with gr.Blocks(title = 'DALL-E Image Generator', theme = 'base') as image_genera
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
+
     # Launching the Gradio UI
     image_generator.launch()
\ No newline at end of file
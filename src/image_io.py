@@ -0,0 +1,178 @@
+# Importing the necessary Python libraries
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+import binascii
+import threading
+from io import BytesIO
+from collections import OrderedDict, deque
+from PIL import Image, UnidentifiedImageError
+
+
+
+## IMAGE SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting where the images returned by DALL-E are written before they are handed to the UI
+IMAGE_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), 'dalle-images')
+
+# Setting how long the images written to IMAGE_OUTPUT_DIR are kept, and the most kept at once, before the oldest are deleted
+# (Gradio copies the images it serves into its own cache, so they are only needed until the handler has returned them)
+IMAGE_OUTPUT_MAX_AGE_SECONDS = 60 * 60
+IMAGE_OUTPUT_MAX_FILES = 500
+
+# Setting how many base64 characters to decode at a time (must be a multiple of 4)
+B64_CHUNK_SIZE = 1024 * 1024
+
+# Setting the largest image DALL-E will accept as the basis for variations
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024
+
+# Setting how many normalized uploads are kept in memory, keyed by the hash of the original upload
+NORMALIZED_UPLOAD_CACHE_SIZE = 64
+
+# Keeping track of the normalized uploads
+normalized_upload_cache = OrderedDict()
+normalized_upload_lock = threading.Lock()
+
+# Keeping track of the images written to IMAGE_OUTPUT_DIR, oldest first (None until any left by an earlier run are picked up)
+output_images = None
+output_images_lock = threading.Lock()
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def prune_output_images(new_image_path):
+    '''
+    Records a new image in IMAGE_OUTPUT_DIR and deletes the oldest images once they are too old or there are too many
+
+    Inputs:
+        - new_image_path (str): The path of the image just written
+
+    Returns:
+        - N/A
+    '''
+
+    global output_images
+
+    with output_images_lock:
+
+        # Picking up any images left behind by an earlier run the first time round, so they get cleaned up too
+        if output_images is None:
+            earlier_images = [os.path.join(IMAGE_OUTPUT_DIR, file_name) for file_name in os.listdir(IMAGE_OUTPUT_DIR)]
+            earlier_images = [(os.path.getmtime(image_path), image_path) for image_path in earlier_images if image_path != new_image_path]
+            output_images = deque(sorted(earlier_images))
+
+        output_images.append((time.time(), new_image_path))
+
+        while output_images and (len(output_images) > IMAGE_OUTPUT_MAX_FILES or time.time() - output_images[0][0] > IMAGE_OUTPUT_MAX_AGE_SECONDS):
+            _, old_image_path = output_images.popleft()
+            try:
+                os.remove(old_image_path)
+            except FileNotFoundError:
+                pass
+
+
+
+def save_b64_image(b64_json, output_path = None):
+    '''
+    Decodes a base64 encoded PNG from DALL-E straight to disk in chunks, without ever decoding it into a PIL image
+
+    Inputs:
+        - b64_json (str): The base64 encoded PNG returned by DALL-E
+        - output_path (str): Where to write the PNG (default = a new file in IMAGE_OUTPUT_DIR, cleaned up once it is old)
+
+    Returns:
+        - output_path (str): The path to the PNG, which Gradio can serve to the browser as-is
+    '''
+
+    is_output_image = output_path is None
+    if is_output_image:
+        os.makedirs(IMAGE_OUTPUT_DIR, exist_ok = True)
+        output_path = os.path.join(IMAGE_OUTPUT_DIR, f'{uuid.uuid4().hex}.png')
+
+    # Decoding a chunk at a time so the full decoded image is never held in memory alongside the base64 text
+    with open(output_path, 'wb') as f:
+        for chunk_start in range(0, len(b64_json), B64_CHUNK_SIZE):
+            f.write(binascii.a2b_base64(b64_json[chunk_start:chunk_start + B64_CHUNK_SIZE]))
+
+    # Keeping IMAGE_OUTPUT_DIR from growing without limit on a long-running server
+    if is_output_image:
+        prune_output_images(output_path)
+
+    return output_path
+
+
+
+
+def encode_png(image, max_bytes = MAX_UPLOAD_BYTES):
+    '''
+    Encodes an image as a PNG, falling back to a palette image and then smaller sizes until it fits under max_bytes
+
+    Inputs:
+        - image (PIL): The image to encode
+        - max_bytes (int): The largest the encoded PNG may be (default = MAX_UPLOAD_BYTES)
+
+    Returns:
+        - png_bytes (bytes): The encoded PNG
+    '''
+
+    while True:
+        for reduce_colors in [False, True]:
+            candidate_image = image.quantize(colors = 256, method = Image.Quantize.FASTOCTREE) if reduce_colors else image
+            png_buffer = BytesIO()
+            candidate_image.save(png_buffer, format = 'PNG', optimize = True)
+            if png_buffer.tell() <= max_bytes:
+                return png_buffer.getvalue()
+
+        image = image.resize((image.width // 2, image.height // 2), Image.LANCZOS)
+
+
+
+def normalize_upload_image(image_path, size = '1024x1024'):
+    '''
+    Validates an uploaded image and turns it into a square PNG of the target size under 4MB, ready to send to DALL-E
+
+    Inputs:
+        - image_path (str): The path to the image uploaded by the user
+        - size (str): The size of the images DALL-E will generate, which the upload is scaled to (default = '1024x1024')
+
+    Returns:
+        - png_bytes (bytes): The normalized PNG
+    '''
+
+    with open(image_path, 'rb') as f:
+        upload_bytes = f.read()
+
+    # Reusing the normalized image if this exact upload (at this size) has been seen before
+    cache_key = hashlib.sha256(upload_bytes + size.encode()).hexdigest()
+    with normalized_upload_lock:
+        if cache_key in normalized_upload_cache:
+            normalized_upload_cache.move_to_end(cache_key)
+            return normalized_upload_cache[cache_key]
+
+    # Making sure the upload really is an image before it is sent anywhere
+    try:
+        with Image.open(BytesIO(upload_bytes)) as upload_image:
+            upload_image.load()
+            image = upload_image.convert('RGBA' if 'A' in upload_image.getbands() else 'RGB')
+    except (UnidentifiedImageError, OSError) as error:
+        raise ValueError(f'The uploaded file could not be read as an image: {error}')
+
+    # Cropping the center square out of the image and scaling it to the target size
+    target_width, target_height = map(int, size.split('x'))
+    crop_size = min(image.size)
+    crop_left, crop_top = (image.width - crop_size) // 2, (image.height - crop_size) // 2
+    image = image.crop((crop_left, crop_top, crop_left + crop_size, crop_top + crop_size))
+    if image.size != (target_width, target_height):
+        image = image.resize((target_width, target_height), Image.LANCZOS)
+
+    png_bytes = encode_png(image)
+
+    with normalized_upload_lock:
+        normalized_upload_cache[cache_key] = png_bytes
+        while len(normalized_upload_cache) > NORMALIZED_UPLOAD_CACHE_SIZE:
+            normalized_upload_cache.popitem(last = False)
+
+    return png_bytes
@@ -0,0 +1,507 @@
+# Importing the necessary Python libraries
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from chat_context import count_chat_flow_tokens
+
+
+
+## INSTRUMENTATION SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the port the Prometheus-style metrics are served on (0 turns the metrics endpoint off)
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9464))
+
+# Setting whether every API call and Gradio event is written out as a structured JSON log line
+LOG_API_CALLS = os.environ.get('LOG_API_CALLS', '1') != '0'
+
+# Setting the upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+# Keeping track of the request ID of the Gradio event (or CLI prompt) currently being handled, which follows it into any tasks it starts
+current_request_id = contextvars.ContextVar('current_request_id', default = None)
+
+# Writing the structured logs as one JSON object per line to stderr
+api_call_logger = logging.getLogger('openai_calls')
+api_call_logger.setLevel(logging.INFO)
+api_call_logger.propagate = False
+if not api_call_logger.handlers:
+    log_handler = logging.StreamHandler(sys.stderr)
+    log_handler.setFormatter(logging.Formatter('%(message)s'))
+    api_call_logger.addHandler(log_handler)
+
+
+
+## METRICS
+## ---------------------------------------------------------------------------------------------------------------------
+class Counter:
+    '''
+    A Prometheus-style counter, with one running total per combination of label values
+    '''
+
+    def __init__(self, name, description, label_names):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount = 1):
+        with self.lock:
+            self.totals[label_values] = self.totals.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+            for label_values, total in sorted(self.totals.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, label_values)} {total}')
+        return lines
+
+
+
+class Histogram:
+    '''
+    A Prometheus-style histogram, with one set of cumulative buckets per combination of label values
+    '''
+
+    def __init__(self, name, description, label_names, buckets = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            bucket_counts, totals = self.series.setdefault(label_values, ([0] * len(self.buckets), [0, 0.0]))
+            for bucket_number, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[bucket_number] += 1
+            totals[0] += 1
+            totals[1] += value
+
+    def render(self):
+        with self.lock:
+            lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+            for label_values, (bucket_counts, (count, total)) in sorted(self.series.items()):
+                for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append(f'{self.name}_bucket{format_labels(self.label_names + ("le",), label_values + (str(upper_bound),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names + ("le",), label_values + ("+Inf",))} {count}')
+                lines.append(f'{self.name}_count{format_labels(self.label_names, label_values)} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.label_names, label_values)} {total}')
+        return lines
+
+
+
+# Defining the metrics recorded for every API call and every Gradio event
+api_calls_total = Counter('openai_api_calls_total', 'API calls made, by outcome', ('endpoint', 'model', 'status'))
+api_call_seconds = Histogram('openai_api_call_seconds', 'Wall time of API calls, including queueing and retries', ('endpoint', 'model'))
+api_queue_seconds = Histogram('openai_api_queue_seconds', 'Time API calls spent waiting on the rate limit budgets', ('endpoint', 'model'))
+api_first_byte_seconds = Histogram('openai_api_time_to_first_byte_seconds', 'Time until the response (or its first streamed chunk) arrived', ('endpoint', 'model'))
+api_tokens_total = Counter('openai_api_tokens_total', 'Tokens used by API calls', ('endpoint', 'model', 'kind'))
+api_payload_bytes_total = Counter('openai_api_payload_bytes_total', 'Bytes of payload (text, files and images) sent to and received from the API', ('endpoint', 'model', 'direction'))
+api_retries_total = Counter('openai_api_retries_total', 'Retries of failed API calls', ('endpoint', 'model'))
+handler_events_total = Counter('gradio_events_total', 'Gradio events handled, by outcome', ('handler', 'status'))
+handler_seconds = Histogram('gradio_event_seconds', 'Wall time of Gradio events', ('handler',))
+
+# Defining the metrics recorded by the response cache and by the coalescing of identical requests in flight
+cache_lookups_total = Counter('openai_cache_lookups_total', 'Response cache lookups, by where they were answered from', ('result',))
+cache_evictions_total = Counter('openai_cache_evictions_total', 'Responses evicted from the on-disk cache', ())
+coalesced_requests_total = Counter('openai_coalesced_requests_total', 'Requests that started a shared API call or joined one already in flight', ('outcome',))
+
+ALL_METRICS = [
+    api_calls_total, api_call_seconds, api_queue_seconds, api_first_byte_seconds, api_tokens_total,
+    api_payload_bytes_total, api_retries_total, handler_events_total, handler_seconds,
+    cache_lookups_total, cache_evictions_total, coalesced_requests_total
+]
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def format_labels(label_names, label_values):
+    '''
+    Formats a set of labels the way the Prometheus text format expects them (e.g. {endpoint="ChatCompletion.create"})
+
+    Inputs:
+        - label_names (tuple): The names of the labels
+        - label_values (tuple): The values of the labels, in the same order
+
+    Returns:
+        - formatted_labels (str): The formatted labels, or an empty string if there are none
+    '''
+
+    if not label_names:
+        return ''
+
+    escaped_values = [str(label_value).replace('\\', '\\\\').replace('"', '\\"') for label_value in label_values]
+
+    return '{' + ','.join(f'{label_name}="{label_value}"' for label_name, label_value in zip(label_names, escaped_values)) + '}'
+
+
+
+def render_metrics():
+    '''
+    Renders every metric in the Prometheus text exposition format
+
+    Inputs:
+        - N/A
+
+    Returns:
+        - metrics_text (str): The metrics, ready to be scraped
+    '''
+
+    return '\n'.join(line for metric in ALL_METRICS for line in metric.render()) + '\n'
+
+
+
+def get_api_name(api_function):
+    '''
+    Gets the name of an API function, treating the sync and async versions of an endpoint as the same endpoint
+
+    Inputs:
+        - api_function (function): The OpenAI API function being called (e.g. openai.ChatCompletion.acreate)
+
+    Returns:
+        - api_name (str): The name of the endpoint (e.g. 'ChatCompletion.create')
+    '''
+
+    return re.sub(r'\.a(?=create|transcribe|translate)', '.', api_function.__qualname__)
+
+
+
+def get_payload_bytes(params):
+    '''
+    Works out roughly how many bytes a request sends to the API
+
+    Inputs:
+        - params (dict): The parameters being passed to the API
+
+    Returns:
+        - payload_bytes (int): The size of any uploaded files, message text and prompt
+    '''
+
+    payload_bytes = 0
+    for param_name, param_value in params.items():
+        if isinstance(param_value, bytes):
+            payload_bytes += len(param_value)
+        elif hasattr(param_value, 'seek'):
+            position = param_value.tell()
+            payload_bytes += param_value.seek(0, os.SEEK_END) - position
+            param_value.seek(position)
+        elif param_name == 'messages':
+            payload_bytes += sum(len(message['content']) for message in param_value)
+        elif isinstance(param_value, str):
+            payload_bytes += len(param_value)
+
+    return payload_bytes
+
+
+
+def get_response_bytes(response):
+    '''
+    Works out roughly how many bytes a response carried from the payload fields it has, without re-encoding the response
+
+    Inputs:
+        - response (dict): The response returned by the API
+
+    Returns:
+        - payload_bytes (int): The size of the completion text, transcript text, or images (base64 or URLs) in the response
+    '''
+
+    payload_bytes = len(response.get('text') or '')
+
+    for choice in response.get('choices') or []:
+        payload_bytes += len((choice.get('message') or {}).get('content') or choice.get('text') or '')
+
+    for image in response.get('data') or []:
+        payload_bytes += len(image.get('b64_json') or image.get('url') or '')
+
+    return payload_bytes
+
+
+
+class ApiCallRecord:
+    '''
+    Records the timing, tokens, payload sizes and retries of one API call as it goes through the request scheduler
+    '''
+
+    def __init__(self, api_function, params):
+        self.request_id = current_request_id.get()
+        self.labels = (get_api_name(api_function), params.get('model', 'dall-e'))
+        self.messages = params.get('messages')
+        self.sent_bytes = get_payload_bytes(params)
+        self.start_time = time.perf_counter()
+        self.attempt_start_time = self.start_time
+        self.queue_seconds = 0
+        self.retries = 0
+
+    def queued(self, queue_seconds):
+        self.queue_seconds += queue_seconds
+        self.attempt_start_time = time.perf_counter()
+
+    def retried(self):
+        self.retries += 1
+
+    def failed(self, error):
+        self.record('error', time.perf_counter() - self.attempt_start_time, 0, 0, 0, repr(error))
+
+    def succeeded(self, response):
+        '''
+        Records a finished call, or wraps a streamed response so the call is recorded once the stream has been read
+
+        Returns:
+            - response (dict or generator): The response, to be handed back to the caller in place of the original
+        '''
+
+        first_byte_seconds = time.perf_counter() - self.attempt_start_time
+
+        if hasattr(response, '__aiter__'):
+            return self.instrument_async_stream(response)
+        if inspect.isgenerator(response):
+            return self.instrument_stream(response)
+
+        usage = response.get('usage') or {}
+        received_bytes = get_response_bytes(response)
+        self.record('ok', first_byte_seconds, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), received_bytes)
+
+        return response
+
+    def count_stream_chunk(self, chunk, stream_totals):
+        if stream_totals['first_byte_seconds'] is None:
+            stream_totals['first_byte_seconds'] = time.perf_counter() - self.attempt_start_time
+
+        # Counting each streamed chunk of content as a token, which is how the API streams its answers back
+        delta_content = chunk['choices'][0].get('delta', {}).get('content') if chunk.get('choices') else None
+        if delta_content:
+            stream_totals['received_bytes'] += len(delta_content)
+            stream_totals['completion_tokens'] += 1
+
+    def finish_stream(self, stream_totals, status):
+        # Streams do not report their usage, so counting the prompt tokens ourselves
+        prompt_tokens = count_chat_flow_tokens(self.messages) if self.messages else 0
+        first_byte_seconds = stream_totals['first_byte_seconds'] or time.perf_counter() - self.attempt_start_time
+        self.record(status, first_byte_seconds, prompt_tokens, stream_totals['completion_tokens'], stream_totals['received_bytes'])
+
+    async def instrument_async_stream(self, response):
+        stream_totals = {'first_byte_seconds': None, 'received_bytes': 0, 'completion_tokens': 0}
+        status = 'error'
+        try:
+            async for chunk in response:
+                self.count_stream_chunk(chunk, stream_totals)
+                yield chunk
+            status = 'ok'
+        finally:
+            self.finish_stream(stream_totals, status)
+
+    def instrument_stream(self, response):
+        stream_totals = {'first_byte_seconds': None, 'received_bytes': 0, 'completion_tokens': 0}
+        status = 'error'
+        try:
+            for chunk in response:
+                self.count_stream_chunk(chunk, stream_totals)
+                yield chunk
+            status = 'ok'
+        finally:
+            self.finish_stream(stream_totals, status)
+
+    def record(self, status, first_byte_seconds, prompt_tokens, completion_tokens, received_bytes, error = None):
+        wall_seconds = time.perf_counter() - self.start_time
+
+        api_calls_total.inc(self.labels + (status,))
+        api_call_seconds.observe(self.labels, wall_seconds)
+        api_queue_seconds.observe(self.labels, self.queue_seconds)
+        api_first_byte_seconds.observe(self.labels, first_byte_seconds)
+        api_tokens_total.inc(self.labels + ('prompt',), prompt_tokens)
+        api_tokens_total.inc(self.labels + ('completion',), completion_tokens)
+        api_payload_bytes_total.inc(self.labels + ('sent',), self.sent_bytes)
+        api_payload_bytes_total.inc(self.labels + ('received',), received_bytes)
+        api_retries_total.inc(self.labels, self.retries)
+
+        if LOG_API_CALLS:
+            api_call_logger.info(json.dumps({
+                'event': 'api_call',
+                'request_id': self.request_id,
+                'endpoint': self.labels[0],
+                'model': self.labels[1],
+                'status': status,
+                'wall_seconds': round(wall_seconds, 4),
+                'queue_seconds': round(self.queue_seconds, 4),
+                'first_byte_seconds': round(first_byte_seconds, 4),
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'sent_bytes': self.sent_bytes,
+                'received_bytes': received_bytes,
+                'retries': self.retries,
+                'error': error
+            }))
+
+
+
+def log_handler_event(handler_name, request_id, status, wall_seconds, first_update_seconds):
+    '''
+    Records the outcome and timing of one Gradio event (or CLI prompt)
+
+    Inputs:
+        - handler_name (str): The name of the handler function
+        - request_id (str): The request ID given to the event
+        - status (str): 'ok', 'error' or 'cancelled'
+        - wall_seconds (float): How long the event took from start to finish
+        - first_update_seconds (float): How long until the first update was handed back to the UI
+
+    Returns:
+        - N/A
+    '''
+
+    handler_events_total.inc((handler_name, status))
+    handler_seconds.observe((handler_name,), wall_seconds)
+
+    if LOG_API_CALLS:
+        api_call_logger.info(json.dumps({
+            'event': 'handler',
+            'request_id': request_id,
+            'handler': handler_name,
+            'status': status,
+            'wall_seconds': round(wall_seconds, 4),
+            'first_update_seconds': round(first_update_seconds, 4) if first_update_seconds is not None else None
+        }))
+
+
+
+def instrumented_handler(handler):
+    '''
+    Wraps a Gradio handler so every event it handles gets its own request ID and has its timing and outcome recorded
+
+    Inputs:
+        - handler (function): The handler, which may be a plain function, a coroutine function or an async generator function
+
+    Returns:
+        - instrumented_handler (function): The wrapped handler, of the same kind as the original so Gradio treats it the same way
+    '''
+
+    handler_name = handler.__name__
+
+    if inspect.isasyncgenfunction(handler):
+
+        @functools.wraps(handler)
+        async def wrapped_handler(*args, **kwargs):
+            request_id, start_time = uuid.uuid4().hex, time.perf_counter()
+            status, first_update_seconds = 'error', None
+            handler_updates = handler(*args, **kwargs)
+            try:
+                while True:
+
+                    # Setting the request ID again for every step, since Gradio may resume the generator from a different task
+                    request_id_token = current_request_id.set(request_id)
+                    try:
+                        update = await handler_updates.__anext__()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        current_request_id.reset(request_id_token)
+
+                    if first_update_seconds is None:
+                        first_update_seconds = time.perf_counter() - start_time
+                    yield update
+
+                status = 'ok'
+            except (GeneratorExit, asyncio.CancelledError):
+                status = 'cancelled'
+                raise
+            finally:
+                await handler_updates.aclose()
+                log_handler_event(handler_name, request_id, status, time.perf_counter() - start_time, first_update_seconds)
+
+    elif inspect.iscoroutinefunction(handler):
+
+        @functools.wraps(handler)
+        async def wrapped_handler(*args, **kwargs):
+            request_id, start_time = uuid.uuid4().hex, time.perf_counter()
+            request_id_token = current_request_id.set(request_id)
+            status = 'error'
+            try:
+                result = await handler(*args, **kwargs)
+                status = 'ok'
+                return result
+            except asyncio.CancelledError:
+                status = 'cancelled'
+                raise
+            finally:
+                current_request_id.reset(request_id_token)
+                log_handler_event(handler_name, request_id, status, time.perf_counter() - start_time, time.perf_counter() - start_time)
+
+    else:
+
+        @functools.wraps(handler)
+        def wrapped_handler(*args, **kwargs):
+            request_id, start_time = uuid.uuid4().hex, time.perf_counter()
+            request_id_token = current_request_id.set(request_id)
+            status = 'error'
+            try:
+                result = handler(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                current_request_id.reset(request_id_token)
+                log_handler_event(handler_name, request_id, status, time.perf_counter() - start_time, time.perf_counter() - start_time)
+
+    return wrapped_handler
+
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Serves the metrics to Prometheus (or anything else) on GET /metrics
+    '''
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        metrics_bytes = render_metrics().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(metrics_bytes)))
+        self.end_headers()
+        self.wfile.write(metrics_bytes)
+
+    def log_message(self, *args):
+        # Keeping scrapes out of the logs
+        pass
+
+
+
+def start_metrics_server(port = METRICS_PORT):
+    '''
+    Starts serving the metrics on a background thread
+
+    Inputs:
+        - port (int): The port to serve the metrics on, or 0 to not serve them (default = METRICS_PORT)
+
+    Returns:
+        - metrics_server (ThreadingHTTPServer): The running server, or None if it was turned off or the port is taken
+    '''
+
+    if not port:
+        return None
+
+    try:
+        metrics_server = ThreadingHTTPServer(('', port), MetricsRequestHandler)
+    except OSError as error:
+        api_call_logger.warning(json.dumps({'event': 'metrics_server_unavailable', 'port': port, 'error': str(error)}))
+        return None
+
+    threading.Thread(target = metrics_server.serve_forever, daemon = True).start()
+
+    return metrics_server
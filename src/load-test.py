@@ -0,0 +1,309 @@
+# Importing the necessary Python libraries
+import os
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import tempfile
+import importlib.util
+from mock_openai_server import DEFAULT_HOST, DEFAULT_PORT, DEFAULT_SERVER_CONFIG, start_server
+
+
+
+## LOAD TEST SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the audio file and image the transcription and variation scenarios upload
+AUDIO_FILE_PATH = '../data/whisper-test.m4a'
+IMAGE_FILE_PATH = '../data/car.png'
+
+# Setting the percentiles to report for each scenario
+REPORT_PERCENTILES = [50, 95, 99]
+
+# Setting the rate limit budget used in place of the real one, so the scheduler never holds back requests to the stand-in server
+UNLIMITED_RATE_LIMIT = {'requests_per_minute': 10 ** 9, 'tokens_per_minute': None}
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def load_app(app_file):
+    '''
+    Imports one of the apps in this directory, whose file names are not valid module names, without launching its UI
+
+    Inputs:
+        - app_file (str): The file name of the app (e.g. 'chat-ui.py')
+
+    Returns:
+        - app_module (module): The imported app
+    '''
+
+    app_spec = importlib.util.spec_from_file_location(app_file[:-3].replace('-', '_'), app_file)
+    app_module = importlib.util.module_from_spec(app_spec)
+    app_spec.loader.exec_module(app_module)
+
+    return app_module
+
+
+
+async def drain(handler_output):
+    '''
+    Runs a handler through to the end, the way Gradio would, whether it returns a value or yields updates
+
+    Inputs:
+        - handler_output (coroutine or async generator): What calling the handler returned
+
+    Returns:
+        - first_update_seconds (float): The seconds until the handler's first update reached the UI
+        - final_output (object): The last thing the handler returned or yielded
+    '''
+
+    start_time = time.perf_counter()
+
+    if not hasattr(handler_output, '__aiter__'):
+        final_output = await handler_output
+        return time.perf_counter() - start_time, final_output
+
+    first_update_seconds = None
+    async for final_output in handler_output:
+        if first_update_seconds is None:
+            first_update_seconds = time.perf_counter() - start_time
+
+    return first_update_seconds, final_output
+
+
+
+def get_scenarios():
+    '''
+    Gets the scenarios that drive each app's Gradio handler functions the way a single user click would
+
+    Inputs:
+        - N/A
+
+    Returns:
+        - scenarios (dict): A function per scenario name that makes one request and returns its first update time in seconds
+    '''
+
+    chat_ui = load_app('chat-ui.py')
+    convo_sim = load_app('convo-sim.py')
+    image_generator = load_app('image-generator.py')
+    similar_image_generator = load_app('similar-image-generator.py')
+    whisper = load_app('whisper.py')
+
+    async def chat():
+        first_update_seconds, _ = await drain(chat_ui.process_prompt('Hello there, how are yousa today?', [], None))
+        return first_update_seconds
+
+    async def convo():
+        # Giving every conversation its own topic so none of them pick up another one's prefetched opener
+        first_update_seconds, _ = await drain(convo_sim.converse_amongst_philosophers('Socrates', 'Alan Watts', f'Pizza #{uuid.uuid4().hex[:8]}', [], rounds = 1))
+        return first_update_seconds
+
+    async def image():
+        first_update_seconds, dalle_image = await drain(image_generator.generate_image(f'A gungan eating pizza #{uuid.uuid4().hex[:8]}'))
+        os.remove(dalle_image)
+        return first_update_seconds
+
+    async def variations():
+        first_update_seconds, output_gallery = await drain(similar_image_generator.generate_similar_images(IMAGE_FILE_PATH))
+        for image_path in output_gallery:
+            os.remove(image_path)
+        return first_update_seconds
+
+    async def transcribe():
+        # Handing the handler its own copy of the audio, since it cleans up the upload it is given the way Gradio's temp files are
+        audio_fd, audio_path = tempfile.mkstemp(suffix = os.path.splitext(AUDIO_FILE_PATH)[1])
+        os.close(audio_fd)
+        shutil.copyfile(AUDIO_FILE_PATH, audio_path)
+        first_update_seconds, _ = await drain(whisper.transcribe(audio_path))
+        return first_update_seconds
+
+    return {'chat': chat, 'convo': convo, 'image': image, 'variations': variations, 'transcribe': transcribe}
+
+
+
+def percentile(sorted_values, percent):
+    '''
+    Gets a percentile of some already sorted values using the nearest-rank method
+
+    Inputs:
+        - sorted_values (list): The values, sorted in ascending order
+        - percent (float): The percentile to get, between 0 and 100
+
+    Returns:
+        - value (float): The percentile, or None if there are no values
+    '''
+
+    if not sorted_values:
+        return None
+
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+
+    return sorted_values[int(rank) - 1]
+
+
+
+async def run_scenario(scenario, num_requests, concurrency):
+    '''
+    Makes a number of requests through a scenario with a fixed number of them in flight at once
+
+    Inputs:
+        - scenario (function): The scenario to run
+        - num_requests (int): The total number of requests to make
+        - concurrency (int): The number of requests to keep in flight at the same time
+
+    Returns:
+        - scenario_results (dict): The latencies and first update times of the requests that succeeded, the errors and the wall time
+    '''
+
+    scenario_results = {'latencies': [], 'first_updates': [], 'errors': []}
+    request_numbers = iter(range(num_requests))
+
+    async def worker():
+        # Pulling requests off the shared iterator until it runs dry, so only `concurrency` requests are in flight at once
+        for _ in request_numbers:
+            start_time = time.perf_counter()
+            try:
+                first_update_seconds = await scenario()
+            except Exception as error:
+                scenario_results['errors'].append(error)
+                continue
+            scenario_results['latencies'].append(time.perf_counter() - start_time)
+            scenario_results['first_updates'].append(first_update_seconds)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    scenario_results['wall_seconds'] = time.perf_counter() - start_time
+
+    return scenario_results
+
+
+
+def format_report(scenario_name, scenario_results):
+    '''
+    Formats one line of the load test report
+
+    Inputs:
+        - scenario_name (str): The name of the scenario
+        - scenario_results (dict): The results of running the scenario
+
+    Returns:
+        - report_line (str): The scenario's requests per second, latency percentiles and error count
+    '''
+
+    latencies = sorted(scenario_results['latencies'])
+    first_updates = sorted(scenario_results['first_updates'])
+    requests_per_second = len(latencies) / scenario_results['wall_seconds']
+
+    percentile_columns = []
+    for percent in REPORT_PERCENTILES:
+        latency = percentile(latencies, percent)
+        percentile_columns.append(f'{latency * 1000:>8.0f}ms' if latency is not None else f"{'-':>10}")
+
+    first_update = percentile(first_updates, 50)
+    first_update_column = f'{first_update * 1000:>8.0f}ms' if first_update is not None else f"{'-':>10}"
+
+    return f"{scenario_name:<11}  {requests_per_second:>8.1f}  {'  '.join(percentile_columns)}  {first_update_column}  {len(scenario_results['errors']):>6}"
+
+
+
+async def run_load_test(scenario_names, num_requests, concurrency, respect_rate_limits, coalesce_requests, server_config, base_url):
+    '''
+    Runs the load test, starting the stand-in server in this process unless another server was given
+
+    Inputs:
+        - scenario_names (list): The names of the scenarios to run, one after another
+        - num_requests (int): The number of requests to make in each scenario
+        - concurrency (int): The number of requests to keep in flight at the same time
+        - respect_rate_limits (bool): Whether the scheduler should still hold requests to the real rate limit budgets
+        - coalesce_requests (bool): Whether identical requests in flight at the same time should still share one call
+        - server_config (dict): The behavior settings for the in-process stand-in server
+        - base_url (str): The base URL of a server that is already running, or None to start the stand-in server here
+
+    Returns:
+        - N/A
+    '''
+
+    # Pointing the apps at the stand-in server before any of them configure the shared OpenAI client
+    server_runner = None
+    if base_url is None:
+        server_runner = await start_server(DEFAULT_HOST, DEFAULT_PORT, **server_config)
+        base_url = f'http://{DEFAULT_HOST}:{DEFAULT_PORT}/v1'
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-load-test')
+    os.environ.setdefault('LOG_API_CALLS', '0')
+    os.environ.setdefault('CONVERSATION_DB_PATH', os.path.join(tempfile.gettempdir(), 'load-test-conversations.db'))
+
+    import response_cache
+    import request_coalescing
+    import request_scheduler
+    from openai_client import get_async_session
+
+    # Making every request go all the way to the server (unless asked to coalesce), and not be held back by budgets meant for the real API
+    response_cache.CACHE_RESPONSES = False
+    request_coalescing.COALESCE_REQUESTS = coalesce_requests
+    if not respect_rate_limits:
+        request_scheduler.RATE_LIMITS = {}
+        request_scheduler.DEFAULT_RATE_LIMIT = UNLIMITED_RATE_LIMIT
+
+    scenarios = get_scenarios()
+
+    try:
+        print(f'Sending {num_requests} requests per scenario to {base_url}, {concurrency} at a time\n')
+        percentile_headers = '  '.join(f'p{percent}'.rjust(10) for percent in REPORT_PERCENTILES)
+        print(f"{'scenario':<11}  {'req/s':>8}  {percentile_headers}  {'1st update':>10}  {'errors':>6}")
+
+        for scenario_name in scenario_names:
+            scenario_results = await run_scenario(scenarios[scenario_name], num_requests, concurrency)
+            print(format_report(scenario_name, scenario_results))
+            if scenario_results['errors']:
+                print(f"{'':<11}  first error: {scenario_results['errors'][0]!r}")
+
+    finally:
+        await get_async_session().close()
+        if server_runner is not None:
+            await server_runner.cleanup()
+
+
+
+## SCRIPT INVOCATION
+## ---------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    scenario_names = ['chat', 'convo', 'image', 'variations', 'transcribe']
+
+    # Setting up the command line arguments
+    parser = argparse.ArgumentParser(description = "Load tests the apps' handler functions against a local stand-in for the OpenAI API.")
+    parser.add_argument('--scenarios', nargs = '+', default = scenario_names, choices = scenario_names, help = 'The scenarios to run (default = all of them)')
+    parser.add_argument('--requests', type = int, default = 200, help = 'The number of requests to make in each scenario (default = 200)')
+    parser.add_argument('--concurrency', type = int, default = 32, help = 'The number of requests to keep in flight at the same time (default = 32)')
+    parser.add_argument('--respect-rate-limits', action = 'store_true', help = "Keep the scheduler's real rate limit budgets in place")
+    parser.add_argument('--coalesce', action = 'store_true', help = 'Let identical requests in flight at the same time share one call, as they do in the apps')
+    parser.add_argument('--base-url', default = None, help = 'The base URL of an already running server to test against (default = start the stand-in server in this process)')
+    parser.add_argument('--latency', type = float, default = DEFAULT_SERVER_CONFIG['latency_seconds'], help = 'The seconds the stand-in server waits before answering each request')
+    parser.add_argument('--jitter', type = float, default = DEFAULT_SERVER_CONFIG['latency_jitter_seconds'], help = 'The most the latency varies by either way, in seconds')
+    parser.add_argument('--chunk-latency', type = float, default = DEFAULT_SERVER_CONFIG['chunk_latency_seconds'], help = 'The seconds between streamed chunks')
+    parser.add_argument('--error-rate', type = float, default = DEFAULT_SERVER_CONFIG['error_rate'], help = 'The fraction of requests the stand-in server fails with a 429 or 5xx error')
+    parser.add_argument('--completion-words', type = int, default = DEFAULT_SERVER_CONFIG['completion_words'], help = 'The number of words in each chat completion')
+    parser.add_argument('--image-bytes', type = int, default = DEFAULT_SERVER_CONFIG['image_bytes'], help = 'The size of each generated image, in bytes')
+    parser.add_argument('--transcript-words', type = int, default = DEFAULT_SERVER_CONFIG['transcript_words'], help = 'The number of words in each transcript')
+    args = parser.parse_args()
+
+    # Running the scenarios and reporting the throughput and latency of each
+    asyncio.run(run_load_test(
+        args.scenarios,
+        args.requests,
+        args.concurrency,
+        args.respect_rate_limits,
+        args.coalesce,
+        {
+            'latency_seconds': args.latency,
+            'latency_jitter_seconds': args.jitter,
+            'chunk_latency_seconds': args.chunk_latency,
+            'error_rate': args.error_rate,
+            'completion_words': args.completion_words,
+            'image_bytes': args.image_bytes,
+            'transcript_words': args.transcript_words
+        },
+        args.base_url
+    ))
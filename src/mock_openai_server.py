@@ -0,0 +1,302 @@
+# Importing the necessary Python libraries
+import json
+import time
+import zlib
+import uuid
+import base64
+import random
+import struct
+import asyncio
+import argparse
+from aiohttp import web
+
+
+
+## SERVER SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting where the stand-in server listens by default
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Setting the default behavior of the stand-in server (all of which can be changed from the command line)
+DEFAULT_SERVER_CONFIG = {
+    'latency_seconds': 0.2,
+    'latency_jitter_seconds': 0.05,
+    'chunk_latency_seconds': 0.01,
+    'error_rate': 0.0,
+    'completion_words': 60,
+    'image_bytes': 1024 * 1024,
+    'transcript_words': 120
+}
+
+# Setting the words the stand-in completions and transcripts are made of
+FILLER_WORDS = ['meesa', 'yousa', 'okeyday', 'the', 'gungans', 'naboo', 'bombad', 'jedi', 'philosophy', 'pizza', 'is', 'very']
+
+# Setting the errors the stand-in server fails with, as (HTTP status, OpenAI error type, message)
+SIMULATED_ERRORS = [
+    (429, 'requests', 'Rate limit reached (simulated by the stand-in server).'),
+    (500, 'server_error', 'The server had an error while processing your request (simulated by the stand-in server).'),
+    (503, 'server_error', 'The server is overloaded (simulated by the stand-in server).')
+]
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def build_png(num_bytes):
+    '''
+    Builds a valid PNG padded out to roughly the given size, standing in for an image generated by DALL-E
+
+    Inputs:
+        - num_bytes (int): The size the PNG should be, in bytes
+
+    Returns:
+        - png_bytes (bytes): The PNG
+    '''
+
+    def png_chunk(chunk_type, chunk_data):
+        return struct.pack('>I', len(chunk_data)) + chunk_type + chunk_data + struct.pack('>I', zlib.crc32(chunk_type + chunk_data))
+
+    # Drawing a single white pixel, then padding the file out with a private ancillary chunk that image readers skip over
+    header = png_chunk(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+    pixels = png_chunk(b'IDAT', zlib.compress(b'\x00\xff\xff\xff'))
+    padding = png_chunk(b'poLy', random.randbytes(max(0, num_bytes - 69)))
+
+    return b'\x89PNG\r\n\x1a\n' + header + pixels + padding + png_chunk(b'IEND', b'')
+
+
+
+def build_text(num_words):
+    '''
+    Builds filler text standing in for a completion or a transcript
+
+    Inputs:
+        - num_words (int): The number of words the text should have
+
+    Returns:
+        - text (str): The filler text
+    '''
+
+    return ' '.join(random.choice(FILLER_WORDS) for _ in range(num_words))
+
+
+
+async def simulate_latency(server_config):
+    '''
+    Waits as long as the real API might take to start answering
+
+    Inputs:
+        - server_config (dict): The stand-in server's behavior settings
+
+    Returns:
+        - N/A
+    '''
+
+    jitter = random.uniform(-server_config['latency_jitter_seconds'], server_config['latency_jitter_seconds'])
+    await asyncio.sleep(max(0, server_config['latency_seconds'] + jitter))
+
+
+
+def simulated_error(server_config):
+    '''
+    Picks an error response to fail the request with, at the configured error rate
+
+    Inputs:
+        - server_config (dict): The stand-in server's behavior settings
+
+    Returns:
+        - error_response (aiohttp Response): An error response shaped like the real API's, or None if the request should succeed
+    '''
+
+    if random.random() >= server_config['error_rate']:
+        return None
+
+    status, error_type, message = random.choice(SIMULATED_ERRORS)
+    error_body = {'error': {'message': message, 'type': error_type, 'param': None, 'code': None}}
+
+    return web.json_response(error_body, status = status, headers = {'retry-after': '0'})
+
+
+
+## ENDPOINTS
+## ---------------------------------------------------------------------------------------------------------------------
+async def chat_completions(request):
+    '''
+    Stands in for the chat completion endpoint, streaming the answer back in chunks if the request asks for it
+    '''
+
+    server_config = request.app['server_config']
+    params = await request.json()
+    await simulate_latency(server_config)
+
+    error_response = simulated_error(server_config)
+    if error_response is not None:
+        return error_response
+
+    completion_id = f'chatcmpl-{uuid.uuid4().hex}'
+    answer_words = build_text(server_config['completion_words']).split()
+    prompt_tokens = sum(len(message['content'].split()) for message in params['messages'])
+
+    if not params.get('stream'):
+        return web.json_response({
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': params['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(answer_words)}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(answer_words), 'total_tokens': prompt_tokens + len(answer_words)}
+        })
+
+    # Streaming the answer back a word at a time as server-sent events, the same way the real API does
+    stream_response = web.StreamResponse(headers = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await stream_response.prepare(request)
+
+    deltas = [{'role': 'assistant'}] + [{'content': (' ' if word_number else '') + word} for word_number, word in enumerate(answer_words)] + [{}]
+    for delta_number, delta in enumerate(deltas):
+        chunk = {
+            'id': completion_id,
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': params['model'],
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if delta else 'stop'}]
+        }
+        await stream_response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+        if delta_number and server_config['chunk_latency_seconds']:
+            await asyncio.sleep(server_config['chunk_latency_seconds'])
+
+    await stream_response.write(b'data: [DONE]\n\n')
+    await stream_response.write_eof()
+
+    return stream_response
+
+
+
+async def image_generations(request):
+    '''
+    Stands in for the image generation and image variation endpoints, answering with as many padded PNGs as were asked for
+    '''
+
+    server_config = request.app['server_config']
+
+    # Reading the whole upload (for variations) or prompt (for generations), just as the real API has to before answering
+    if request.content_type == 'multipart/form-data':
+        params = dict(await request.post())
+    else:
+        params = await request.json()
+    await simulate_latency(server_config)
+
+    error_response = simulated_error(server_config)
+    if error_response is not None:
+        return error_response
+
+    num_images = int(params.get('n', 1))
+    if params.get('response_format', 'url') == 'b64_json':
+        image_data = [{'b64_json': request.app['b64_image']} for _ in range(num_images)]
+    else:
+        image_data = [{'url': f'http://{request.host}/images/{uuid.uuid4().hex}.png'} for _ in range(num_images)]
+
+    return web.json_response({'created': int(time.time()), 'data': image_data})
+
+
+
+async def audio_transcriptions(request):
+    '''
+    Stands in for the audio transcription endpoint, answering with a filler transcript once the whole upload is read
+    '''
+
+    server_config = request.app['server_config']
+    params = dict(await request.post())
+    await simulate_latency(server_config)
+
+    error_response = simulated_error(server_config)
+    if error_response is not None:
+        return error_response
+
+    transcript = build_text(server_config['transcript_words'])
+    if params.get('response_format') == 'text':
+        return web.Response(text = transcript)
+
+    return web.json_response({'text': transcript})
+
+
+
+def create_app(**server_config):
+    '''
+    Creates the stand-in OpenAI server
+
+    Inputs:
+        - server_config (dict): Any behavior settings to change from DEFAULT_SERVER_CONFIG
+
+    Returns:
+        - app (aiohttp Application): The stand-in server, ready to be run
+    '''
+
+    app = web.Application(client_max_size = 64 * 1024 * 1024)
+    app['server_config'] = {**DEFAULT_SERVER_CONFIG, **server_config}
+
+    # Building the stand-in image once up front so every image response costs the same to serve
+    app['b64_image'] = base64.b64encode(build_png(app['server_config']['image_bytes'])).decode()
+
+    app.add_routes([
+        web.post('/v1/chat/completions', chat_completions),
+        web.post('/v1/images/generations', image_generations),
+        web.post('/v1/images/variations', image_generations),
+        web.post('/v1/audio/transcriptions', audio_transcriptions)
+    ])
+
+    return app
+
+
+
+async def start_server(host = DEFAULT_HOST, port = DEFAULT_PORT, **server_config):
+    '''
+    Starts the stand-in OpenAI server on the running event loop
+
+    Inputs:
+        - host (str): The host to listen on (default = DEFAULT_HOST)
+        - port (int): The port to listen on (default = DEFAULT_PORT)
+        - server_config (dict): Any behavior settings to change from DEFAULT_SERVER_CONFIG
+
+    Returns:
+        - runner (aiohttp AppRunner): The running server, which should be cleaned up with `await runner.cleanup()`
+    '''
+
+    runner = web.AppRunner(create_app(**server_config))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
+
+
+
+## SCRIPT INVOCATION
+## ---------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # Setting up the command line arguments
+    parser = argparse.ArgumentParser(description = 'Runs a local stand-in for the OpenAI API (point the apps at it with OPENAI_BASE_URL=http://HOST:PORT/v1).')
+    parser.add_argument('--host', default = DEFAULT_HOST, help = f'The host to listen on (default = {DEFAULT_HOST})')
+    parser.add_argument('--port', type = int, default = DEFAULT_PORT, help = f'The port to listen on (default = {DEFAULT_PORT})')
+    parser.add_argument('--latency', type = float, default = DEFAULT_SERVER_CONFIG['latency_seconds'], help = 'The seconds to wait before answering each request')
+    parser.add_argument('--jitter', type = float, default = DEFAULT_SERVER_CONFIG['latency_jitter_seconds'], help = 'The most the latency varies by either way, in seconds')
+    parser.add_argument('--chunk-latency', type = float, default = DEFAULT_SERVER_CONFIG['chunk_latency_seconds'], help = 'The seconds between streamed chunks')
+    parser.add_argument('--error-rate', type = float, default = DEFAULT_SERVER_CONFIG['error_rate'], help = 'The fraction of requests to fail with a 429 or 5xx error')
+    parser.add_argument('--completion-words', type = int, default = DEFAULT_SERVER_CONFIG['completion_words'], help = 'The number of words in each chat completion')
+    parser.add_argument('--image-bytes', type = int, default = DEFAULT_SERVER_CONFIG['image_bytes'], help = 'The size of each generated image, in bytes')
+    parser.add_argument('--transcript-words', type = int, default = DEFAULT_SERVER_CONFIG['transcript_words'], help = 'The number of words in each transcript')
+    args = parser.parse_args()
+
+    # Running the stand-in server until it is stopped
+    web.run_app(
+        create_app(
+            latency_seconds = args.latency,
+            latency_jitter_seconds = args.jitter,
+            chunk_latency_seconds = args.chunk_latency,
+            error_rate = args.error_rate,
+            completion_words = args.completion_words,
+            image_bytes = args.image_bytes,
+            transcript_words = args.transcript_words
+        ),
+        host = args.host,
+        port = args.port
+    )
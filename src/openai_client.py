@@ -0,0 +1,142 @@
+# Importing the necessary Python libraries
+import os
+import yaml
+import asyncio
+import aiohttp
+import openai
+import requests
+from requests.adapters import HTTPAdapter
+
+
+
+## CLIENT SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting where the API key and organization ID are loaded from (NOT pushed to GitHub)
+KEYS_PATH = os.environ.get('OPENAI_KEYS_PATH', '../keys/openai-keys.yaml')
+
+# Setting the default number of seconds to wait on the API before giving up on a request
+DEFAULT_TIMEOUT = 120
+
+# Setting the default number of keep-alive connections each worker thread holds open to the API
+DEFAULT_POOL_SIZE = 16
+
+# Setting the default number of connections the async session may hold open to the API at once
+DEFAULT_ASYNC_POOL_SIZE = 256
+
+# Keeping one pooled async session per event loop
+async_sessions = {}
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def load_client_config(keys_path = KEYS_PATH):
+    '''
+    Loads the client configuration from the keys file, letting environment variables fill in or override it
+
+    Inputs:
+        - keys_path (str): The path to the YAML file holding the API key and organization ID (default = KEYS_PATH)
+
+    Returns:
+        - client_config (dict): The API key, organization ID, base URL, timeout and connection pool sizes
+    '''
+
+    # Loading the API key and organization ID from file, if there is one
+    keys_yaml = {}
+    if os.path.exists(keys_path):
+        with open(keys_path) as f:
+            keys_yaml = yaml.safe_load(f) or {}
+
+    client_config = {
+        'api_key': os.environ.get('OPENAI_API_KEY', keys_yaml.get('API_KEY')),
+        'organization': os.environ.get('OPENAI_ORGANIZATION', keys_yaml.get('ORG_ID')),
+        'base_url': os.environ.get('OPENAI_BASE_URL', keys_yaml.get('BASE_URL')),
+        'timeout': float(os.environ.get('OPENAI_TIMEOUT', keys_yaml.get('TIMEOUT', DEFAULT_TIMEOUT))),
+        'pool_size': int(os.environ.get('OPENAI_POOL_SIZE', keys_yaml.get('POOL_SIZE', DEFAULT_POOL_SIZE))),
+        'async_pool_size': int(os.environ.get('OPENAI_ASYNC_POOL_SIZE', keys_yaml.get('ASYNC_POOL_SIZE', DEFAULT_ASYNC_POOL_SIZE)))
+    }
+
+    return client_config
+
+
+
+def get_async_session():
+    '''
+    Gets the pooled aiohttp session for the running event loop and hands it to the openai library's async calls
+
+    Inputs:
+        - N/A
+
+    Returns:
+        - async_session (aiohttp ClientSession): The keep-alive session shared by every async request on this event loop
+    '''
+
+    event_loop = asyncio.get_running_loop()
+
+    # Creating one pooled session per event loop, since aiohttp sessions cannot be shared across loops
+    async_session = async_sessions.get(event_loop)
+    if async_session is None or async_session.closed:
+        async_session = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(limit = client_config['async_pool_size']),
+            timeout = aiohttp.ClientTimeout(total = client_config['timeout'])
+        )
+        async_sessions[event_loop] = async_session
+
+    # Pointing the openai library's async calls in the current context at the pooled session
+    openai.aiosession.set(async_session)
+
+    return async_session
+
+
+
+class PooledSession(requests.Session):
+    '''
+    A keep-alive HTTP session with a larger connection pool that applies our timeout to every request
+    '''
+
+    def __init__(self, timeout, pool_size):
+        super().__init__()
+        self.timeout = timeout
+        pooled_adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = 2)
+        self.mount('https://', pooled_adapter)
+        self.mount('http://', pooled_adapter)
+
+    def request(self, *args, **kwargs):
+        # Capping the (very long) default timeout the openai library passes along with our own
+        kwargs['timeout'] = min(kwargs.get('timeout') or self.timeout, self.timeout)
+        return super().request(*args, **kwargs)
+
+
+
+def configure_openai(keys_path = KEYS_PATH):
+    '''
+    Applies the API key, organization ID, base URL and pooled HTTP session to the openai library
+
+    Inputs:
+        - keys_path (str): The path to the YAML file holding the API key and organization ID (default = KEYS_PATH)
+
+    Returns:
+        - client_config (dict): The configuration that was applied
+    '''
+
+    client_config = load_client_config(keys_path)
+
+    # Applying our API key and organization ID to OpenAI
+    openai.organization = client_config['organization']
+    openai.api_key = client_config['api_key']
+
+    # Pointing OpenAI at a different server (e.g. a local stand-in for testing) if a base URL was given
+    if client_config['base_url']:
+        openai.api_base = client_config['base_url']
+
+    # Giving each worker thread its own pooled, keep-alive session (the openai library caches one per thread)
+    openai.requestssession = lambda: PooledSession(client_config['timeout'], client_config['pool_size'])
+
+    return client_config
+
+
+
+## CLIENT INSTANTIATION
+## ---------------------------------------------------------------------------------------------------------------------
+# Configuring OpenAI once, the first time any of the apps imports this module
+client_config = configure_openai()
@@ -0,0 +1,255 @@
+# Importing the necessary Python libraries
+import io
+import json
+import asyncio
+import hashlib
+from instrumentation import get_api_name, coalesced_requests_total
+from request_scheduler import DEFAULT_PRIORITY, async_scheduled_api_call
+
+
+
+## COALESCING SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting whether identical requests that are in flight at the same time share a single call to the API
+COALESCE_REQUESTS = True
+
+# Keeping track of the requests currently in flight, keyed by their request hash
+in_flight_requests = {}
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def hash_request(api_name, params):
+    '''
+    Hashes an API request into a key based on the endpoint, model, parameters and inputs
+
+    Inputs:
+        - api_name (str): The name of the API endpoint being called (e.g. 'ChatCompletion.create')
+        - params (dict): The parameters passed to the API, where any file objects are hashed by their contents
+
+    Returns:
+        - request_key (str): A hex digest identifying the request
+    '''
+
+    request_hash = hashlib.sha256(api_name.encode())
+
+    for param_name in sorted(params):
+        param_value = params[param_name]
+        request_hash.update(param_name.encode())
+
+        # Hashing file objects by their contents, rewinding them so they can still be uploaded afterwards
+        if hasattr(param_value, 'read'):
+            position = param_value.tell()
+            for file_chunk in iter(lambda: param_value.read(1024 * 1024), b''):
+                request_hash.update(file_chunk)
+            param_value.seek(position)
+        elif isinstance(param_value, bytes):
+            request_hash.update(param_value)
+        else:
+            request_hash.update(json.dumps(param_value, sort_keys = True, default = str).encode())
+
+    return request_hash.hexdigest()
+
+
+
+def copy_file_params(params):
+    '''
+    Gives a shared call its own copy of any files being uploaded, so it never reads from a buffer the request that started it may close
+
+    Inputs:
+        - params (dict): The parameters to pass to the API
+
+    Returns:
+        - shared_params (dict): The same parameters, with every file object swapped for an in-memory copy of its contents
+    '''
+
+    shared_params = dict(params)
+
+    for param_name, param_value in params.items():
+        if hasattr(param_value, 'read'):
+            position = param_value.tell()
+            file_copy = io.BytesIO(param_value.read())
+            param_value.seek(position)
+
+            # Keeping the file name, which the openai library uses to tell the API what kind of file is being uploaded
+            file_copy.name = getattr(param_value, 'name', param_name)
+            shared_params[param_name] = file_copy
+
+    return shared_params
+
+
+
+def retrieve_task_error(task):
+    '''
+    Retrieves the error from a finished background task, so one nobody ends up waiting on does not log "Task exception was never retrieved"
+
+    Inputs:
+        - task (asyncio Task): The finished task
+
+    Returns:
+        - N/A
+    '''
+
+    if not task.cancelled():
+        task.exception()
+
+
+
+class InFlightRequest:
+    '''
+    A call to the API that every identical request arriving while it is in flight waits on, streamed responses included, which is
+    cancelled once the last request waiting on it goes away
+    '''
+
+    def __init__(self, request_key):
+        self.request_key = request_key
+        self.response_task = None
+        self.pump_task = None
+        self.num_waiters = 0
+        self.is_stream = False
+        self.chunks = []
+        self.stream_finished = False
+        self.stream_error = None
+        self.new_chunk = asyncio.Event()
+
+    def start(self, start_request):
+        # Creating the call's coroutine straight away, so anything it copies from the caller is copied while the caller still has it
+        self.response_task = asyncio.ensure_future(self.run(start_request()))
+        self.response_task.add_done_callback(retrieve_task_error)
+
+    def forget(self):
+        # Letting the next identical request start a call of its own, unless one already has
+        if in_flight_requests.get(self.request_key) is self:
+            del in_flight_requests[self.request_key]
+
+    def leave(self):
+        # Cancelling the shared call (or the reading of its stream) once nobody is waiting on it any more
+        self.num_waiters -= 1
+        if self.num_waiters > 0:
+            return
+
+        self.forget()
+        if not self.response_task.done():
+            self.response_task.cancel()
+        elif self.pump_task is not None and not self.pump_task.done():
+            self.pump_task.cancel()
+
+    async def run(self, request_coroutine):
+        try:
+            response = await request_coroutine
+        except BaseException:
+            self.forget()
+            raise
+
+        if not hasattr(response, '__aiter__'):
+            self.forget()
+            return response
+
+        # Reading the stream in the background into a shared buffer, so no one waiter's pace holds up the others
+        self.is_stream = True
+        self.pump_task = asyncio.ensure_future(self.pump_stream(response))
+        self.pump_task.add_done_callback(retrieve_task_error)
+
+        return response
+
+    async def pump_stream(self, response):
+        try:
+            async for chunk in response:
+                self.chunks.append(chunk)
+                self.notify_waiters()
+        except Exception as error:
+            self.stream_error = error
+        finally:
+            self.forget()
+            self.stream_finished = True
+            self.notify_waiters()
+
+    def notify_waiters(self):
+        # Waking everyone waiting on the next chunk and setting up a fresh event for the chunk after it
+        self.new_chunk.set()
+        self.new_chunk = asyncio.Event()
+
+    async def replay_stream(self):
+        # Replaying the stream from its first chunk, so requests that join part way through still get the whole response
+        try:
+            chunk_number = 0
+            while True:
+                while chunk_number < len(self.chunks):
+                    yield self.chunks[chunk_number]
+                    chunk_number += 1
+                if self.stream_finished:
+                    break
+                await self.new_chunk.wait()
+
+            if self.stream_error is not None:
+                raise self.stream_error
+        finally:
+            self.leave()
+
+    async def wait(self):
+        # Shielding the shared call so one waiter going away does not cancel it for everyone else still waiting on it
+        self.num_waiters += 1
+        try:
+            await asyncio.shield(self.response_task)
+        except BaseException:
+            self.leave()
+            raise
+
+        if self.is_stream:
+            return self.replay_stream()
+
+        self.leave()
+
+        return self.response_task.result()
+
+
+
+async def coalesce_request(request_key, start_request):
+    '''
+    Makes a request, or waits on the identical request already in flight and shares its response
+
+    Inputs:
+        - request_key (str): The key identifying the request
+        - start_request (function): A function returning the coroutine that calls the API, only called if nothing identical is in flight
+
+    Returns:
+        - response (dict or async generator): The response, where a streamed response is replayed separately to every waiter
+    '''
+
+    if not COALESCE_REQUESTS:
+        return await start_request()
+
+    in_flight_request = in_flight_requests.get(request_key)
+    if in_flight_request is None:
+        in_flight_request = InFlightRequest(request_key)
+        in_flight_requests[request_key] = in_flight_request
+        in_flight_request.start(start_request)
+        coalesced_requests_total.inc(('started',))
+    else:
+        coalesced_requests_total.inc(('joined',))
+
+    return await in_flight_request.wait()
+
+
+
+async def async_coalesced_api_call(api_function, priority = DEFAULT_PRIORITY, request_slot = 0, **params):
+    '''
+    Awaits an async OpenAI API function through the request scheduler, sharing a single call between identical requests in flight at the same time
+
+    Inputs:
+        - api_function (function): The async OpenAI API function to call (e.g. openai.ChatCompletion.acreate)
+        - priority (int): Where the request sits in the scheduler's queue (default = DEFAULT_PRIORITY)
+        - request_slot (int): Which of several deliberately identical requests this is, so they are not merged with each other (default = 0)
+        - params (dict): The parameters to pass to the API function
+
+    Returns:
+        - response (dict or async generator): The response from the API, where a streamed response is replayed separately to every waiter
+    '''
+
+    if not COALESCE_REQUESTS:
+        return await async_scheduled_api_call(api_function, priority = priority, **params)
+
+    request_key = f'{hash_request(get_api_name(api_function), params)}:{request_slot}'
+
+    return await coalesce_request(request_key, lambda: async_scheduled_api_call(api_function, priority = priority, **copy_file_params(params)))
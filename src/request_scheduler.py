@@ -0,0 +1,416 @@
+# Importing the necessary Python libraries
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+import openai
+from chat_context import count_chat_flow_tokens
+from instrumentation import ApiCallRecord
+from openai_client import client_config, get_async_session
+
+
+
+## SCHEDULER SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the requests-per-minute and tokens-per-minute budgets for each model (None means no token budget)
+RATE_LIMITS = {
+    'gpt-3.5-turbo': {'requests_per_minute': 3500, 'tokens_per_minute': 90000},
+    'gpt-4': {'requests_per_minute': 500, 'tokens_per_minute': 10000},
+    'whisper-1': {'requests_per_minute': 50, 'tokens_per_minute': None},
+    'dall-e': {'requests_per_minute': 50, 'tokens_per_minute': None}
+}
+
+# Setting the budget used for any model not listed above
+DEFAULT_RATE_LIMIT = {'requests_per_minute': 500, 'tokens_per_minute': 10000}
+
+# Setting the number of completion tokens to budget for when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+
+# Setting the priorities requests can be queued with (lower goes first)
+INTERACTIVE_PRIORITY = 0
+DEFAULT_PRIORITY = 5
+BATCH_PRIORITY = 10
+
+# Setting how many times a failed request is retried, and the bounds of the exponential backoff between tries
+MAX_RETRIES = 6
+INITIAL_BACKOFF_SECONDS = 1
+MAX_BACKOFF_SECONDS = 60
+
+# Setting the errors from the openai library that are worth retrying
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain
+)
+
+
+
+## TOKEN BUCKETS
+## ---------------------------------------------------------------------------------------------------------------------
+class TokenBucket:
+    '''
+    A token bucket that refills continuously up to a per-minute capacity
+    '''
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.refill_rate = per_minute / 60
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def time_until_available(self, amount):
+        # Never asking for more than a full bucket, so oversized requests still go through once the bucket is full
+        amount = min(amount, self.capacity)
+        return max(0, (amount - self.available) / self.refill_rate)
+
+    def consume(self, amount):
+        self.available -= amount
+
+
+
+class ModelScheduler:
+    '''
+    Hands out turns to call one model in priority order, within its requests-per-minute and tokens-per-minute budgets
+    '''
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.waiting_requests = []
+        self.wake_functions = {}
+        self.lock = threading.Lock()
+
+    def wake_next_request(self):
+        # Telling whichever request is now first in line to check the budgets again (must hold the lock)
+        if self.waiting_requests:
+            self.wake_functions[self.waiting_requests[0]]()
+
+    def enqueue(self, priority, wake):
+        ticket = (priority, next(ticket_counter))
+        with self.lock:
+            heapq.heappush(self.waiting_requests, ticket)
+            self.wake_functions[ticket] = wake
+        return ticket
+
+    def dequeue(self, ticket):
+        with self.lock:
+            if ticket in self.waiting_requests:
+                was_first = self.waiting_requests[0] == ticket
+                self.waiting_requests.remove(ticket)
+                heapq.heapify(self.waiting_requests)
+                del self.wake_functions[ticket]
+                if was_first:
+                    self.wake_next_request()
+
+    def try_acquire(self, ticket, tokens):
+        '''
+        Takes the turn for a queued request if it is first in line and the budgets allow it
+
+        Returns:
+            - wait_seconds (float): 0 if the turn was taken, how long until the budgets refill if the request is first in line,
+              or None if it should wait until it is woken
+        '''
+
+        with self.lock:
+
+            # Making sure higher priority (and earlier) requests go first, leaving the rest to be woken when they move up
+            if self.waiting_requests[0] != ticket:
+                return None
+
+            self.request_bucket.refill()
+            wait_seconds = self.request_bucket.time_until_available(1)
+            if self.token_bucket is not None:
+                self.token_bucket.refill()
+                wait_seconds = max(wait_seconds, self.token_bucket.time_until_available(tokens))
+
+            if wait_seconds > 0:
+                return min(wait_seconds, MAX_BACKOFF_SECONDS)
+
+            # Taking the turn and handing the front of the line to the next request
+            heapq.heappop(self.waiting_requests)
+            del self.wake_functions[ticket]
+            self.request_bucket.consume(1)
+            if self.token_bucket is not None:
+                self.token_bucket.consume(tokens)
+            self.wake_next_request()
+
+            return 0
+
+    def settle_tokens(self, estimated_tokens, used_tokens):
+        # Correcting the token budget once the actual usage of a request is known, waking the next request if tokens were handed back
+        if self.token_bucket is not None:
+            with self.lock:
+                self.token_bucket.consume(used_tokens - estimated_tokens)
+                if used_tokens < estimated_tokens:
+                    self.wake_next_request()
+
+
+
+# Keeping one scheduler per model, shared by every request made from this process
+model_schedulers = {}
+model_schedulers_lock = threading.Lock()
+ticket_counter = itertools.count()
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def get_model_scheduler(params):
+    '''
+    Gets the scheduler for the model a request is going to
+
+    Inputs:
+        - params (dict): The parameters being passed to the API
+
+    Returns:
+        - model_scheduler (ModelScheduler): The scheduler for the request's model
+    '''
+
+    # Treating the image endpoints, which do not take a model, as DALL-E
+    model = params.get('model', 'dall-e')
+
+    with model_schedulers_lock:
+        if model not in model_schedulers:
+            model_schedulers[model] = ModelScheduler(**RATE_LIMITS.get(model, DEFAULT_RATE_LIMIT))
+
+        return model_schedulers[model]
+
+
+
+def estimate_request_tokens(params):
+    '''
+    Estimates the number of tokens a request will use so that it can be budgeted for before it is sent
+
+    Inputs:
+        - params (dict): The parameters being passed to the API
+
+    Returns:
+        - estimated_tokens (int): The estimated prompt plus completion tokens for the request
+    '''
+
+    if 'messages' not in params:
+        return 0
+
+    return count_chat_flow_tokens(params['messages']) + params.get('max_tokens', DEFAULT_COMPLETION_TOKENS)
+
+
+
+def get_used_tokens(response, estimated_tokens):
+    '''
+    Gets the number of tokens a request actually used from its response
+
+    Inputs:
+        - response (dict): The response returned by the API
+        - estimated_tokens (int): The number of tokens the request was budgeted for
+
+    Returns:
+        - used_tokens (int): The tokens used, or the estimate if the response does not report its usage (e.g. streams)
+    '''
+
+    try:
+        return response['usage']['total_tokens']
+    except (KeyError, TypeError):
+        return estimated_tokens
+
+
+
+def get_retry_wait(error, attempt):
+    '''
+    Works out how long to wait before retrying a failed request, or whether it should not be retried at all
+
+    Inputs:
+        - error (Exception): The error raised by the API call
+        - attempt (int): The number of attempts made so far
+
+    Returns:
+        - wait_seconds (float): The number of seconds to wait before retrying, or None if the error should be raised
+    '''
+
+    # Retrying rate limits, timeouts, connection errors and any 5xx error from the server
+    is_server_error = isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+    if attempt >= MAX_RETRIES or not (isinstance(error, RETRYABLE_ERRORS) or is_server_error):
+        return None
+
+    # Backing off exponentially, with full jitter so waiting requests do not all retry at the same moment
+    wait_seconds = random.uniform(0, min(MAX_BACKOFF_SECONDS, INITIAL_BACKOFF_SECONDS * 2 ** attempt))
+
+    # Waiting at least as long as the server has asked us to
+    headers = getattr(error, 'headers', None) or {}
+    try:
+        wait_seconds = max(wait_seconds, float(headers.get('retry-after', 0)))
+    except ValueError:
+        pass
+
+    return wait_seconds
+
+
+
+def accepts_request_timeout(api_function):
+    '''
+    Checks whether an OpenAI API function takes a request_timeout (the image and audio endpoints would send it on to the API instead)
+
+    Inputs:
+        - api_function (function): The OpenAI API function being called (e.g. openai.ChatCompletion.acreate)
+
+    Returns:
+        - accepts_request_timeout (bool): Whether request_timeout can be passed to the function
+    '''
+
+    api_resource = getattr(api_function, '__self__', None)
+
+    return isinstance(api_resource, type) and issubclass(api_resource, openai.api_resources.abstract.engine_api_resource.EngineAPIResource)
+
+
+
+def rewind_file_params(params):
+    '''
+    Notes where any file objects being uploaded currently are, so they can be rewound before a retry
+
+    Inputs:
+        - params (dict): The parameters being passed to the API
+
+    Returns:
+        - rewind (function): A function that seeks every file object back to where it was
+    '''
+
+    file_positions = [(param_value, param_value.tell()) for param_value in params.values() if hasattr(param_value, 'seek')]
+
+    def rewind():
+        for file_object, position in file_positions:
+            file_object.seek(position)
+
+    return rewind
+
+
+
+def scheduled_api_call(api_function, priority = DEFAULT_PRIORITY, **params):
+    '''
+    Calls an OpenAI API function once it is within the rate limit budgets, retrying with backoff if the call fails
+
+    Inputs:
+        - api_function (function): The OpenAI API function to call (e.g. openai.ChatCompletion.create)
+        - priority (int): Where the request sits in the queue, with lower values going first (default = DEFAULT_PRIORITY)
+        - params (dict): The parameters to pass to the API function
+
+    Returns:
+        - response (dict): The response from the API
+    '''
+
+    model_scheduler = get_model_scheduler(params)
+    estimated_tokens = estimate_request_tokens(params)
+    rewind = rewind_file_params(params)
+    api_call_record = ApiCallRecord(api_function, params)
+
+    for attempt in itertools.count():
+
+        # Waiting in line for our turn within the rate limit budgets, sleeping until the budgets refill or we are woken
+        queue_start_time = time.perf_counter()
+        wake_event = threading.Event()
+        ticket = model_scheduler.enqueue(priority, wake_event.set)
+        try:
+            while True:
+                wake_event.clear()
+                wait_seconds = model_scheduler.try_acquire(ticket, estimated_tokens)
+                if wait_seconds == 0:
+                    break
+                wake_event.wait(wait_seconds)
+        except BaseException:
+            model_scheduler.dequeue(ticket)
+            raise
+        api_call_record.queued(time.perf_counter() - queue_start_time)
+
+        try:
+            response = api_function(**params)
+        except Exception as error:
+            retry_wait = get_retry_wait(error, attempt)
+            if retry_wait is None:
+                api_call_record.failed(error)
+                raise
+            api_call_record.retried()
+            time.sleep(retry_wait)
+            rewind()
+            continue
+
+        model_scheduler.settle_tokens(estimated_tokens, get_used_tokens(response, estimated_tokens))
+
+        # Recording the call's timing, tokens and payload sizes (streams are recorded once they have been read through)
+        return api_call_record.succeeded(response)
+
+
+
+async def async_scheduled_api_call(api_function, priority = DEFAULT_PRIORITY, **params):
+    '''
+    Awaits an async OpenAI API function once it is within the rate limit budgets, retrying with backoff if the call fails
+
+    Inputs:
+        - api_function (function): The async OpenAI API function to call (e.g. openai.ChatCompletion.acreate)
+        - priority (int): Where the request sits in the queue, with lower values going first (default = DEFAULT_PRIORITY)
+        - params (dict): The parameters to pass to the API function
+
+    Returns:
+        - response (dict): The response from the API
+    '''
+
+    model_scheduler = get_model_scheduler(params)
+    estimated_tokens = estimate_request_tokens(params)
+    rewind = rewind_file_params(params)
+    api_call_record = ApiCallRecord(api_function, params)
+
+    # Pointing the openai library at the pooled session for this event loop, and applying our timeout to every attempt (the
+    # library otherwise passes its own 600 second timeout with each async request, overriding the session's)
+    get_async_session()
+    request_timeout = params.pop('request_timeout', client_config['timeout'])
+    if accepts_request_timeout(api_function):
+        params['request_timeout'] = request_timeout
+
+    for attempt in itertools.count():
+
+        # Waiting in line for our turn within the rate limit budgets, sleeping until the budgets refill or we are woken (which may
+        # happen from another thread, so the wake is handed to this event loop)
+        queue_start_time = time.perf_counter()
+        wake_event = asyncio.Event()
+        event_loop = asyncio.get_running_loop()
+        ticket = model_scheduler.enqueue(priority, lambda: event_loop.call_soon_threadsafe(wake_event.set))
+        try:
+            while True:
+                wake_event.clear()
+                wait_seconds = model_scheduler.try_acquire(ticket, estimated_tokens)
+                if wait_seconds == 0:
+                    break
+                try:
+                    await asyncio.wait_for(wake_event.wait(), wait_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            model_scheduler.dequeue(ticket)
+            raise
+        api_call_record.queued(time.perf_counter() - queue_start_time)
+
+        try:
+            # Bounding the whole attempt by our timeout too, since only some endpoints take request_timeout
+            response = await asyncio.wait_for(api_function(**params), request_timeout)
+        except Exception as error:
+            if isinstance(error, asyncio.TimeoutError):
+                error = openai.error.Timeout(f'Request timed out after {request_timeout} seconds')
+            retry_wait = get_retry_wait(error, attempt)
+            if retry_wait is None:
+                api_call_record.failed(error)
+                raise error
+            api_call_record.retried()
+            await asyncio.sleep(retry_wait)
+            rewind()
+            continue
+
+        model_scheduler.settle_tokens(estimated_tokens, get_used_tokens(response, estimated_tokens))
+
+        # Recording the call's timing, tokens and payload sizes (streams are recorded once they have been read through)
+        return api_call_record.succeeded(response)
@@ -0,0 +1,293 @@
+# Importing the necessary Python libraries
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from instrumentation import get_api_name, cache_lookups_total, cache_evictions_total
+from request_scheduler import DEFAULT_PRIORITY, async_scheduled_api_call
+from request_coalescing import hash_request, copy_file_params, coalesce_request, async_coalesced_api_call
+
+
+
+## CACHE SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting whether responses are cached at all (turned off, for example, when load testing against a stand-in server)
+CACHE_RESPONSES = True
+
+# Setting where cached responses are stored on disk (NOT pushed to GitHub)
+CACHE_DIR = '../cache/openai-responses'
+
+# Setting how many bytes of responses are held in memory in front of the on-disk store
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Setting the largest the on-disk store is allowed to grow before the oldest responses are evicted
+DISK_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Setting how far the on-disk store is shrunk once it outgrows DISK_CACHE_MAX_BYTES, so evictions happen in batches rather than on every write
+DISK_CACHE_LOW_WATER_BYTES = int(DISK_CACHE_MAX_BYTES * 0.8)
+
+# Setting how long a cached response stays valid, in seconds
+CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Keeping track of the in-memory LRU and its size, and an index of the on-disk store (oldest first) and its size
+memory_cache = OrderedDict()
+memory_cache_bytes = 0
+disk_index = None
+disk_cache_bytes = 0
+cache_lock = threading.Lock()
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def get_cache_path(cache_key):
+    '''
+    Gets the path of a cached response on disk
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+
+    Returns:
+        - cache_path (str): The path to the cached response on disk
+    '''
+
+    return os.path.join(CACHE_DIR, cache_key[:2], cache_key + '.json')
+
+
+
+def load_disk_index():
+    '''
+    Builds the index of the on-disk store the first time it is needed, which is the only time the store is walked (must hold cache_lock)
+
+    Inputs:
+        - N/A
+
+    Returns:
+        - N/A
+    '''
+
+    global disk_index, disk_cache_bytes
+
+    if disk_index is not None:
+        return
+
+    # Listing everything currently on disk, oldest first
+    cached_files = []
+    for root, _, file_names in os.walk(CACHE_DIR):
+        for file_name in file_names:
+            if file_name.endswith('.json'):
+                file_stat = os.stat(os.path.join(root, file_name))
+                cached_files.append((file_stat.st_mtime, file_name[:-len('.json')], file_stat.st_size))
+    cached_files.sort()
+
+    disk_index = OrderedDict((cache_key, file_size) for _, cache_key, file_size in cached_files)
+    disk_cache_bytes = sum(disk_index.values())
+
+
+
+def remember_in_memory(cache_key, cached_at, response, num_bytes):
+    '''
+    Puts a response in the in-memory LRU, evicting the least recently used responses until it fits MEMORY_CACHE_MAX_BYTES (must hold cache_lock)
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+        - cached_at (float): When the response was cached
+        - response (dict): The response returned by the API
+        - num_bytes (int): The size of the response once serialized
+
+    Returns:
+        - N/A
+    '''
+
+    global memory_cache_bytes
+
+    if cache_key in memory_cache:
+        memory_cache_bytes -= memory_cache.pop(cache_key)[2]
+
+    memory_cache[cache_key] = (cached_at, response, num_bytes)
+    memory_cache_bytes += num_bytes
+
+    while memory_cache_bytes > MEMORY_CACHE_MAX_BYTES and memory_cache:
+        memory_cache_bytes -= memory_cache.popitem(last = False)[1][2]
+
+
+
+def forget_on_disk(cache_key):
+    '''
+    Drops a response from the index of the on-disk store (must hold cache_lock)
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+
+    Returns:
+        - removed (bool): Whether the response was in the index
+    '''
+
+    global disk_cache_bytes
+
+    file_size = disk_index.pop(cache_key, None)
+    if file_size is None:
+        return False
+    disk_cache_bytes -= file_size
+
+    return True
+
+
+
+def remove_cache_file(cache_key):
+    '''
+    Removes a cached response from disk, ignoring responses that are already gone
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+
+    Returns:
+        - N/A
+    '''
+
+    try:
+        os.remove(get_cache_path(cache_key))
+    except FileNotFoundError:
+        pass
+
+
+
+def get_cached_response(cache_key):
+    '''
+    Looks up a response in memory first and then on disk, respecting the TTL
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+
+    Returns:
+        - response (dict): The cached response, or None if there is no valid cached response
+    '''
+
+    global memory_cache_bytes
+
+    with cache_lock:
+
+        # Checking the in-memory LRU first
+        if cache_key in memory_cache:
+            cached_at, response, _ = memory_cache[cache_key]
+            if time.time() - cached_at < CACHE_TTL_SECONDS:
+                memory_cache.move_to_end(cache_key)
+                cache_lookups_total.inc(('memory_hit',))
+                return response
+            memory_cache_bytes -= memory_cache.pop(cache_key)[2]
+
+        # Skipping the disk entirely when the index says the response is not there
+        load_disk_index()
+        if cache_key not in disk_index:
+            cache_lookups_total.inc(('miss',))
+            return None
+
+    # Falling back to the on-disk store, reading the file without holding the lock
+    try:
+        with open(get_cache_path(cache_key)) as f:
+            serialized_entry = f.read()
+        cached_entry = json.loads(serialized_entry)
+    except (OSError, ValueError):
+        cached_entry = None
+
+    with cache_lock:
+        if cached_entry is None or time.time() - cached_entry['cached_at'] >= CACHE_TTL_SECONDS:
+            is_stale = forget_on_disk(cache_key)
+            cache_lookups_total.inc(('miss',))
+        else:
+            # Promoting the response into memory for next time
+            remember_in_memory(cache_key, cached_entry['cached_at'], cached_entry['response'], len(serialized_entry))
+            cache_lookups_total.inc(('disk_hit',))
+            return cached_entry['response']
+
+    if is_stale:
+        remove_cache_file(cache_key)
+
+    return None
+
+
+
+def set_cached_response(cache_key, response):
+    '''
+    Stores a response both in memory and on disk, evicting the oldest responses down to DISK_CACHE_LOW_WATER_BYTES once the store outgrows DISK_CACHE_MAX_BYTES
+
+    Inputs:
+        - cache_key (str): The key identifying the request
+        - response (dict): The response returned by the API
+
+    Returns:
+        - N/A
+    '''
+
+    global disk_cache_bytes
+
+    cached_at = time.time()
+    serialized_entry = json.dumps({'cached_at': cached_at, 'response': response})
+
+    # Writing to a temporary file first so a crash never leaves a half-written response behind
+    cache_path = get_cache_path(cache_key)
+    os.makedirs(os.path.dirname(cache_path), exist_ok = True)
+    temp_path = f'{cache_path}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(serialized_entry)
+    os.replace(temp_path, cache_path)
+
+    evicted_keys = []
+    with cache_lock:
+
+        # Storing the response in the in-memory LRU
+        remember_in_memory(cache_key, cached_at, response, len(serialized_entry))
+
+        # Recording the write in the index of the on-disk store as its newest response
+        load_disk_index()
+        forget_on_disk(cache_key)
+        disk_index[cache_key] = len(serialized_entry)
+        disk_cache_bytes += len(serialized_entry)
+
+        # Picking the oldest responses to evict, all the way down to the low-water mark so the next writes have room
+        if disk_cache_bytes > DISK_CACHE_MAX_BYTES:
+            while disk_cache_bytes > DISK_CACHE_LOW_WATER_BYTES and len(disk_index) > 1:
+                evicted_key, file_size = disk_index.popitem(last = False)
+                disk_cache_bytes -= file_size
+                evicted_keys.append(evicted_key)
+            cache_evictions_total.inc((), len(evicted_keys))
+
+    for evicted_key in evicted_keys:
+        remove_cache_file(evicted_key)
+
+
+
+async def async_cached_api_call(api_function, priority = DEFAULT_PRIORITY, **params):
+    '''
+    Awaits an async OpenAI API function through the request scheduler, returning the cached response (or sharing the identical request in flight) instead if there is one
+
+    Inputs:
+        - api_function (function): The async OpenAI API function to call (e.g. openai.ChatCompletion.acreate)
+        - priority (int): Where the request sits in the scheduler's queue on a cache miss (default = DEFAULT_PRIORITY)
+        - params (dict): The parameters to pass to the API function
+
+    Returns:
+        - response (dict): The response from the API, or from the cache
+    '''
+
+    if not CACHE_RESPONSES:
+        return await async_coalesced_api_call(api_function, priority = priority, **params)
+
+    cache_key = hash_request(get_api_name(api_function), params)
+
+    # Reading and writing the cache off the event loop, since either may have to touch the disk
+    response = await asyncio.to_thread(get_cached_response, cache_key)
+    if response is None:
+
+        async def fetch_and_cache_response(shared_params):
+            response = await async_scheduled_api_call(api_function, priority = priority, **shared_params)
+            await asyncio.to_thread(set_cached_response, cache_key, response)
+            return response
+
+        # Sharing one call (and one cache write) between identical requests that miss the cache at the same time, with its own
+        # copy of any files so it does not depend on the caller's buffers
+        response = await coalesce_request(cache_key, lambda: fetch_and_cache_response(copy_file_params(params)))
+
+    return response
@@ -0,0 +1,94 @@
+# Importing the necessary Python libraries
+import re
+import random
+import timeit
+from sensitive_data import scan_sensitive_data, check_sensitive_data
+
+
+
+## BENCHMARK SETTINGS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the prompt sizes (in characters) to benchmark
+PROMPT_SIZES = [256, 1024, 4096, 16384]
+
+# Setting how many times each prompt is scanned per timing run, and how many timing runs to take the best of
+NUMBER_OF_SCANS = 200
+NUMBER_OF_RUNS = 5
+
+# Setting the words the benchmark prompts are made of, with some sensitive data sprinkled in
+PROMPT_WORDS = ['meesa', 'yousa', 'okeyday', 'the', 'gungans', 'naboo', 'bombad', 'jedi', '2023', 'version', '3.5', 'turbo']
+SENSITIVE_WORDS = ['123-45-6789', '4111 1111 1111 1111', 'jarjar@naboo.gov', '(555) 123-4567', 'sk-abcdefghijklmnopqrstuvwxyz012345']
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def build_prompt(prompt_size, include_sensitive_data):
+    '''
+    Builds a prompt of roughly the given size to benchmark against
+
+    Inputs:
+        - prompt_size (int): The number of characters the prompt should have
+        - include_sensitive_data (bool): Whether to put a piece of sensitive data at the very end of the prompt
+
+    Returns:
+        - prompt (str): The benchmark prompt
+    '''
+
+    words = []
+    while sum(len(word) + 1 for word in words) < prompt_size:
+        words.append(random.choice(PROMPT_WORDS))
+
+    # Putting the sensitive data at the end, which is the worst case for a scanner that stops at the first match
+    if include_sensitive_data:
+        words.append(random.choice(SENSITIVE_WORDS))
+
+    return ' '.join(words)
+
+
+
+def legacy_check_sensitive_data(user_prompt):
+    '''
+    The original SSN-only check, which recompiles its regex on every call, kept as a baseline to compare against
+    '''
+
+    ssn_regex = r'\b(?!000)(?!666)(?!9\d{2})\d{3}[-]?(?!00)\d{2}[-]?(?!0000)\d{4}\b'
+
+    return bool(re.search(ssn_regex, user_prompt))
+
+
+
+def time_microseconds(scanner, prompt):
+    '''
+    Times a scanner over a prompt
+
+    Inputs:
+        - scanner (function): The scanning function to time
+        - prompt (str): The prompt to scan
+
+    Returns:
+        - microseconds (float): The best time per scan across the timing runs, in microseconds
+    '''
+
+    best_seconds = min(timeit.repeat(lambda: scanner(prompt), number = NUMBER_OF_SCANS, repeat = NUMBER_OF_RUNS))
+
+    return best_seconds / NUMBER_OF_SCANS * 1e6
+
+
+
+## SCRIPT INVOCATION
+## ---------------------------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    random.seed(0)
+
+    print(f"{'chars':>6}  {'sensitive':>9}  {'legacy (ssn only)':>18}  {'check':>10}  {'scan':>10}")
+    for prompt_size in PROMPT_SIZES:
+        for include_sensitive_data in [False, True]:
+            prompt = build_prompt(prompt_size, include_sensitive_data)
+            print(
+                f'{prompt_size:>6}  {str(include_sensitive_data):>9}  '
+                f'{time_microseconds(legacy_check_sensitive_data, prompt):>16.1f}us  '
+                f'{time_microseconds(check_sensitive_data, prompt):>8.1f}us  '
+                f'{time_microseconds(scan_sensitive_data, prompt):>8.1f}us'
+            )
@@ -0,0 +1,197 @@
+# Importing the necessary Python libraries
+import re
+
+
+
+## SENSITIVE DATA PATTERNS
+## ---------------------------------------------------------------------------------------------------------------------
+# Setting the patterns for each type of sensitive data, most specific first since the first alternative to match wins
+SENSITIVE_DATA_PATTERNS = {
+    'api_key': r'(?:sk-[A-Za-z0-9_-]{20,}|AKIA[0-9A-Z]{16}|gh[pousr]_[A-Za-z0-9]{36,}|xox[abprs]-[A-Za-z0-9-]{10,}|AIza[0-9A-Za-z_-]{35})',
+    'email': r'[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b',
+    'ssn': r'(?!000)(?!666)(?!9\d{2})\d{3}[-]?(?!00)\d{2}[-]?(?!0000)\d{4}\b',
+    'credit_card': r'\d(?:[ -]?\d){12,18}\b',
+    'phone': r'(?:\+?1[ .-]?)?(?:\(\d{3}\)|\b\d{3})[ .-]?\d{3}[ .-]?\d{4}\b'
+}
+
+# Compiling every pattern into a single matcher once, so a prompt is scanned in one pass for all types of sensitive data
+# (every match has to start at the beginning of a word or at a bracket or plus sign, which lets the matcher skip the
+# middle of words cheaply)
+sensitive_data_regex = re.compile(r'(?:(?<!\w)|(?=[(+]))(?:' + '|'.join(f'(?P<{data_type}>{pattern})' for data_type, pattern in SENSITIVE_DATA_PATTERNS.items()) + ')')
+
+# Setting the characters that may separate the digits of a credit card number
+CARD_SEPARATORS = str.maketrans('', '', ' -')
+
+# Setting the prefixes an API key can start with, and the characters every other type of sensitive data contains
+API_KEY_PREFIXES = ('sk-', 'AKIA', 'ghp_', 'gho_', 'ghu_', 'ghs_', 'ghr_', 'xox', 'AIza')
+CANDIDATE_CHARACTERS = '0123456789@'
+
+# Setting a byte translation table that marks the candidate characters with a 1 and everything else with a 0
+CANDIDATE_MARKS = bytes(chr(byte) in CANDIDATE_CHARACTERS for byte in range(256))
+
+# Setting how far either side of a candidate character the full matcher needs to look
+CANDIDATE_WINDOW = 32
+CANDIDATE_GAP = bytes(2 * CANDIDATE_WINDOW)
+
+# Setting the whitespace a candidate window is widened out to, so a window never cuts through the middle of a match
+WINDOW_BOUNDARIES = (' ', '\n', '\t')
+
+# Setting what each piece of sensitive data is replaced with when a prompt is redacted rather than rejected
+REDACTION_MASKS = {data_type: f'[REDACTED {data_type.upper()}]' for data_type in SENSITIVE_DATA_PATTERNS}
+
+
+
+## HELPER FUNCTIONS
+## ---------------------------------------------------------------------------------------------------------------------
+def passes_luhn_check(card_number):
+    '''
+    Checks a credit card number against the Luhn checksum, which weeds out most numbers that only look like cards
+
+    Inputs:
+        - card_number (str): The digits of the card number
+
+    Returns:
+        - passes_check (bool): A boolean value indicating if the number has a valid checksum
+    '''
+
+    checksum = 0
+    for position, digit in enumerate(map(int, reversed(card_number))):
+        if position % 2:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        checksum += digit
+
+    return checksum % 10 == 0
+
+
+
+def find_candidate_windows(user_prompt):
+    '''
+    Finds the regions of a prompt that could possibly hold sensitive data, so the full matcher can skip everything else
+
+    Inputs:
+        - user_prompt (str): The user's inputted prompt
+
+    Returns:
+        - candidate_windows (list): Non-overlapping (start, end) regions of the prompt to run the full matcher over, in order
+    '''
+
+    # Falling back to scanning the whole prompt if it is not plain ASCII, since the byte offsets would not line up
+    if not user_prompt.isascii():
+        return [(0, len(user_prompt))]
+
+    # Marking every digit and @ sign in one pass in C, then grouping marks into windows that end at the first long enough
+    # gap without any marks (also found in C, so the Python loop only runs once per window)
+    candidate_marks = user_prompt.encode('ascii').translate(CANDIDATE_MARKS)
+    candidate_windows = []
+    position = candidate_marks.find(1)
+    while position != -1:
+        window_gap = candidate_marks.find(CANDIDATE_GAP, position)
+        window_gap = len(candidate_marks) if window_gap == -1 else window_gap
+        candidate_windows.append((max(0, position - CANDIDATE_WINDOW), window_gap + CANDIDATE_WINDOW))
+        position = candidate_marks.find(1, window_gap)
+
+    # Adding a window for every API key prefix, since keys need not contain a digit
+    for api_key_prefix in API_KEY_PREFIXES:
+        position = user_prompt.find(api_key_prefix)
+        while position != -1:
+            candidate_windows.append((position, position + len(api_key_prefix)))
+            position = user_prompt.find(api_key_prefix, position + 1)
+
+    # Widening each window out to the surrounding whitespace and merging any windows that then overlap
+    merged_windows = []
+    for window_start, window_end in sorted(candidate_windows):
+        window_start = max(user_prompt.rfind(boundary, 0, window_start) for boundary in WINDOW_BOUNDARIES) + 1
+        window_end = min((user_prompt.find(boundary, window_end) for boundary in WINDOW_BOUNDARIES), key = lambda end: end if end != -1 else len(user_prompt))
+        window_end = len(user_prompt) if window_end == -1 else window_end
+
+        if merged_windows and window_start <= merged_windows[-1][1]:
+            merged_windows[-1] = (merged_windows[-1][0], max(merged_windows[-1][1], window_end))
+        else:
+            merged_windows.append((window_start, window_end))
+
+    return merged_windows
+
+
+
+def iterate_sensitive_data(user_prompt):
+    '''
+    Runs the single-pass matcher over just the candidate windows of a prompt, yielding each piece of sensitive data found
+
+    Inputs:
+        - user_prompt (str): The user's inputted prompt
+
+    Yields:
+        - sensitive_span (tuple): A (start, end, data_type) tuple for each piece of sensitive data, in order
+    '''
+
+    for window_start, window_end in find_candidate_windows(user_prompt):
+        for match in sensitive_data_regex.finditer(user_prompt, window_start, window_end):
+            data_type = match.lastgroup
+
+            # Only counting credit card numbers that pass the Luhn check
+            if data_type == 'credit_card' and not passes_luhn_check(match.group().translate(CARD_SEPARATORS)):
+                continue
+
+            yield match.start(), match.end(), data_type
+
+
+
+def scan_sensitive_data(user_prompt):
+    '''
+    Scans the user's prompt for sensitive data such as SSNs, credit cards, emails, phone numbers and API keys
+
+    Inputs:
+        - user_prompt (str): The user's inputted prompt
+
+    Returns:
+        - sensitive_spans (list): A (start, end, data_type) tuple for every piece of sensitive data found, in order
+    '''
+
+    return list(iterate_sensitive_data(user_prompt))
+
+
+
+def check_sensitive_data(user_prompt):
+    '''
+    Checks the user's prompt to see if any sensitive information has been pass in via the prompt
+
+    Inputs:
+        - user_prompt (str): The user's inputted prompt
+
+    Returns:
+        - has_sensitive_data (bool): A boolean value indicating if the prompt contains sensitive data
+    '''
+
+    # Stopping at the first piece of sensitive data rather than scanning the rest of the prompt
+    return next(iterate_sensitive_data(user_prompt), None) is not None
+
+
+
+def redact_sensitive_data(user_prompt):
+    '''
+    Masks every piece of sensitive data in the user's prompt in place, so the rest of the prompt can still be sent on
+
+    Inputs:
+        - user_prompt (str): The user's inputted prompt
+
+    Returns:
+        - redacted_prompt (str): The prompt with each piece of sensitive data replaced by a mask naming its type
+        - sensitive_spans (list): A (start, end, data_type) tuple for every piece of sensitive data found in the original prompt
+    '''
+
+    sensitive_spans = scan_sensitive_data(user_prompt)
+
+    # Returning the prompt untouched (without copying it) when there is nothing to mask
+    if not sensitive_spans:
+        return user_prompt, sensitive_spans
+
+    # Stitching the redacted prompt together from the text between the matches and the masks in one join
+    prompt_pieces = []
+    previous_end = 0
+    for start, end, data_type in sensitive_spans:
+        prompt_pieces.append(user_prompt[previous_end:start])
+        prompt_pieces.append(REDACTION_MASKS[data_type])
+        previous_end = end
+    prompt_pieces.append(user_prompt[previous_end:])
+
+    return ''.join(prompt_pieces), sensitive_spans
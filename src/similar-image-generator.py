@@ -1,55 +1,77 @@
 # Importing the necessary Python libraries
-import yaml
-from io import BytesIO
-from PIL import Image
-from base64 import b64decode
-import openai
+import asyncio
 import gradio as gr
+from image_io import save_b64_image, normalize_upload_image
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## OPENAI CONNECTION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
+from request_coalescing import async_coalesced_api_call
 
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Setting the number of similar images to generate, and how many of them to ask DALL-E for in each concurrent request
+NUM_VARIATIONS = 5
+VARIATIONS_PER_REQUEST = 1
 
 
 
 ## GRADIO HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def generate_similar_images(upload_image):
+@instrumented_handler
+async def generate_similar_images(upload_image):
     '''
-    Generates similar images based on an input image
+    Generates similar images based on an input image, showing each image in the gallery as soon as it is ready
 
     Inputs:
-        - upload_image (PIL): An image uploaded by the user that will be the basis to create similar images
+        - upload_image (str): The path to the image uploaded by the user that will be the basis to create similar images
 
-    Returns:
-        - output_gallery (list): A list of images that will be returned in a display gallery
+    Yields:
+        - output_gallery (list): A list of PNG image paths that will be returned in a display gallery, growing as the images arrive
     '''
-    # Using DALL-E to generate the image as a base64 encoded object
-    openai_response = openai.Image.create_variation(
-        image = open(upload_image, 'rb'),
-        n = 5,
-        size = '1024x1024',
-        response_format = 'b64_json'
-    )
+
+    # Checking the uploaded image and normalizing it into a square PNG under 4MB before anything is sent to DALL-E (off the
+    # event loop, since the resizing and PNG encoding are CPU bound)
+    try:
+        upload_image_bytes = await asyncio.to_thread(normalize_upload_image, upload_image, size = '1024x1024')
+    except ValueError as error:
+        raise gr.Error(str(error))
+
+    # Splitting the variations into smaller concurrent requests to DALL-E, each returning a base64 encoded object (numbering
+    # the requests so they are not merged with each other, only with the same requests from anyone uploading the same image)
+    variation_requests = [
+        async_coalesced_api_call(
+            openai.Image.acreate_variation,
+            request_slot = num_requested,
+            image = upload_image_bytes,
+            n = min(VARIATIONS_PER_REQUEST, NUM_VARIATIONS - num_requested),
+            size = '1024x1024',
+            response_format = 'b64_json'
+        )
+        for num_requested in range(0, NUM_VARIATIONS, VARIATIONS_PER_REQUEST)
+    ]
 
     # Creating a list to hold all the images as the output gallery
     output_gallery = []
+    request_errors = []
 
-    # Iterating through all the images returned by DALL-E
-    for image in openai_response['data']:
-        
-        # Appending the DALL-E generated image to the gallery
-        output_gallery.append(Image.open(BytesIO(b64decode(image['b64_json']))))
+    # Adding the images to the gallery as each request comes back, carrying on past any request that fails
+    for variation_request in asyncio.as_completed(variation_requests):
+        try:
+            openai_response = await variation_request
+        except Exception as error:
+            request_errors.append(error)
+            continue
 
-    return output_gallery
+        for image in openai_response['data']:
+            output_gallery.append(await asyncio.to_thread(save_b64_image, image['b64_json']))
+        yield output_gallery
+
+    # Letting the user know if none of the requests succeeded
+    if not output_gallery:
+        raise gr.Error(f'DALL-E could not generate any similar images: {request_errors[0]}')
 
 
 ## GRADIO UI LAYOUT & FUNCTIONALITY
@@ -61,7 +83,7 @@ with gr.Blocks(title = 'DALL-E Similar Image Generator', theme = 'base') as simi
     header = gr.Markdown('''
     # DALL-E Similar Images Generator
     
-    Upload an image of what you would like DALL-E to produce a gallery of similar images. Please note that this upload image must be a `.png` image and must be less than 4MB.
+    Upload an image of what you would like DALL-E to produce a gallery of similar images. Any common image format works; it will be cropped to a square and converted to a `.png` under 4MB before it is sent to DALL-E.
     '''
     )
     upload_image = gr.Image(label = 'Image Uploader', type = 'filepath')
@@ -86,5 +108,8 @@ with gr.Blocks(title = 'DALL-E Similar Image Generator', theme = 'base') as simi
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    # Launching the Gradio UI
-    similar_image_generator.launch()
\ No newline at end of file
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
+
+    # Launching the Gradio UI (queueing is required for the images to stream into the gallery)
+    similar_image_generator.queue().launch()
\ No newline at end of file
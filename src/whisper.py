@@ -1,46 +1,63 @@
 import os
-import yaml
-import openai
+import asyncio
 import gradio as gr
+from audio_io import prepare_audio_segments, merge_transcripts
+from response_cache import async_cached_api_call
+from instrumentation import instrumented_handler, start_metrics_server
 
 
 
 ## OPENAI CONNECTION
 ## ---------------------------------------------------------------------------------------------------------------------
-# Loading the API key and organization ID from file (NOT pushed to GitHub)
-with open('../keys/openai-keys.yaml') as f:
-    keys_yaml = yaml.safe_load(f)
-
-# Applying our API key and organization ID to OpenAI
-openai.organization = keys_yaml['ORG_ID']
-openai.api_key = keys_yaml['API_KEY']
+# Configuring OpenAI with our keys and a pooled, keep-alive HTTP session through the shared client module
+from openai_client import openai
 
 
 
 ## GRADIO HELPER FUNCTIONS
 ## ---------------------------------------------------------------------------------------------------------------------
-def transcribe(audio_intake_file):
+@instrumented_handler
+async def transcribe(audio_intake_file):
     '''
-    Transcribes the input audio using OpenAI's Whisper API
+    Transcribes the input audio using OpenAI's Whisper API, splitting long recordings into segments transcribed concurrently
 
     Inputs:
         - audio_intake_file (.wav audio file): Audio intake received from the Gradio UI
 
-    Returns:
-        - transcript (Gradio textbox): The transcription provided by OpenAI's Whisper API
+    Yields:
+        - transcript (Gradio textbox): The transcription provided by OpenAI's Whisper API, growing as the segments finish
     '''
 
-    # Appending the .wav file extension to the existing audio file
-    os.rename(audio_intake_file, audio_intake_file + '.wav')
-    print(audio_intake_file)
-
-    # Loading the audio file in a read-only bytes format
-    rb_audio = open(audio_intake_file, 'rb')
-
-    # Getting the transcription from OpenAI's Whisper API
-    transcript = openai.Audio.transcribe(model = 'whisper-1', file = rb_audio)
-
-    return transcript
+    # Compressing the audio to mono 16 kHz (if COMPRESS_AUDIO is on) and splitting it at silences into overlapping in-memory
+    # segments (short recordings stay as a single segment) off the event loop, since decoding and encoding it is CPU bound,
+    # then cleaning up Gradio's temp file so a long-running server does not fill /tmp
+    try:
+        audio_segments = await asyncio.to_thread(prepare_audio_segments, audio_intake_file)
+    finally:
+        os.remove(audio_intake_file)
+
+    # Getting the transcription of every segment from OpenAI's Whisper API at the same time, reusing any cached transcripts
+    segment_requests = [
+        asyncio.ensure_future(async_cached_api_call(openai.Audio.atranscribe, model = 'whisper-1', file = audio_segment))
+        for audio_segment in audio_segments
+    ]
+
+    # Stitching the segments together in order as they finish, showing the transcript each time it grows
+    transcript = ''
+    num_stitched = 0
+    try:
+        for finished_request in asyncio.as_completed(segment_requests):
+            await finished_request
+            while num_stitched < len(segment_requests) and segment_requests[num_stitched].done():
+                transcript = merge_transcripts(transcript, segment_requests[num_stitched].result()['text'])
+                num_stitched += 1
+                yield transcript
+    finally:
+        # Cancelling any segments still in flight if the user has gone away or a segment failed, and freeing the segments
+        for segment_request in segment_requests:
+            segment_request.cancel()
+        for audio_segment in audio_segments:
+            audio_segment.close()
 
 
 
@@ -69,5 +86,8 @@ with gr.Blocks() as whisper_ui:
 ## ---------------------------------------------------------------------------------------------------------------------
 if __name__ == "__main__":
 
-    # Launching the Gradio UI
-    whisper_ui.launch()
\ No newline at end of file
+    # Serving the per-call latency, token and error metrics for Prometheus to scrape
+    start_metrics_server()
+
+    # Launching the Gradio UI (queueing is required for the transcript to stream into the textbox)
+    whisper_ui.queue().launch()
\ No newline at end of file